@@ -1,10 +1,20 @@
 # app/api/excel.py
 from fastapi import APIRouter, HTTPException, Query
 from pydantic import BaseModel
-from typing import List, Any, Tuple
+from typing import List, Any, Tuple, Dict, Optional
 from openpyxl import load_workbook
+from collections import OrderedDict
+from datetime import date, datetime, time
 import os
 import re
+import threading
+import numpy as np
+
+try:
+    # Optional Rust-backed reader; much faster row materialization than openpyxl
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
 
 router = APIRouter()
 
@@ -40,21 +50,232 @@ def resolve_excel_path(file_id: str) -> str:
         detail=f"Excel file not found in uploads: {file_id}"
     )
 
+# ---- Workbook cache ---------------------------------------------
+# Opening an XLSX with openpyxl unzips and parses the workbook, which can take
+# minutes for large files. Tile requests hit the same file over and over, so
+# keep a handful of read-only workbooks open, keyed by (path, mtime).
+_WORKBOOK_CACHE_SIZE = 8
+_workbook_cache: "OrderedDict[Tuple[str, float], _CachedWorkbook]" = OrderedDict()
+_workbook_cache_lock = threading.Lock()
+
+
+# Sheets read with calamine are kept as Python rows, across all cached workbooks,
+# up to this many cells in total (least recently used sheets are dropped first).
+# Larger sheets are not kept: each tile reads just the rows down to its end.
+_CALAMINE_CACHE_MAX_CELLS = 10_000_000
+_calamine_sheets: "OrderedDict[Tuple[_CachedWorkbook, str], Tuple[List[List[Any]], int]]" = OrderedDict()
+_calamine_cells = 0
+_calamine_sheets_lock = threading.Lock()
+
+
+def _get_calamine_sheet(key) -> Optional[List[List[Any]]]:
+    with _calamine_sheets_lock:
+        entry = _calamine_sheets.get(key)
+        if entry is None:
+            return None
+        _calamine_sheets.move_to_end(key)
+        return entry[0]
+
+
+def _put_calamine_sheet(key, rows: List[List[Any]], cells: int):
+    global _calamine_cells
+    with _calamine_sheets_lock:
+        if key in _calamine_sheets:
+            return
+        _calamine_sheets[key] = (rows, cells)
+        _calamine_cells += cells
+        while _calamine_cells > _CALAMINE_CACHE_MAX_CELLS:
+            _calamine_cells -= _calamine_sheets.popitem(last=False)[1][1]
+
+
+def _drop_calamine_sheets(workbook: "_CachedWorkbook"):
+    global _calamine_cells
+    with _calamine_sheets_lock:
+        for key in [k for k in _calamine_sheets if k[0] is workbook]:
+            _calamine_cells -= _calamine_sheets.pop(key)[1]
+
+
+def _normalize_calamine_value(value):
+    """Convert a calamine cell value to the type openpyxl returns for it"""
+    # calamine reads every number as float and date-only cells as date
+    if type(value) is float:
+        return int(value) if value.is_integer() else value
+    if type(value) is date:
+        return datetime.combine(value, time())
+    return value
+
+
+class _CachedWorkbook:
+    """Open read-only workbook plus lazily filled per-sheet dimensions"""
+
+    def __init__(self, path: str, wb):
+        self.path = path
+        # Requests currently reading this workbook; an evicted entry is closed when the last one releases it
+        self._users = 0
+        self._evicted = False
+        self._users_lock = threading.Lock()
+        self.wb = wb
+        self.dims: Dict[str, Tuple[int, int]] = {}
+        self._calamine = None
+        self._calamine_lock = threading.Lock()
+
+    def sheet_dims(self, sheet_name: str) -> Tuple[int, int]:
+        """(max_row, max_col) for a sheet, computed once per workbook"""
+        dims = self.dims.get(sheet_name)
+        if dims is None:
+            ws = self.wb[sheet_name]
+            dims = (ws.max_row or 1, ws.max_column or 1)
+            self.dims[sheet_name] = dims
+        return dims
+
+    def _read_calamine_tile(self, sheet_name: str, r0: int, r1: int, c0: int, c1: int) -> List[List[Any]]:
+        """Tile from the sheet parsed with python-calamine; the parsed sheet is kept while the budget allows"""
+        key = (self, sheet_name)
+        rows = _get_calamine_sheet(key)
+        if rows is None:
+            with self._calamine_lock:
+                rows = _get_calamine_sheet(key)
+                if rows is None:
+                    if self._calamine is None:
+                        self._calamine = CalamineWorkbook.from_path(self.path)
+                    sheet = self._calamine.get_sheet_by_name(sheet_name)
+                    max_r, max_c = self.sheet_dims(sheet_name)
+                    if max_r * max_c > _CALAMINE_CACHE_MAX_CELLS:
+                        # Too large to keep in memory: read only down to the tile's last row
+                        grid = sheet.to_python(skip_empty_area=False, nrows=r1)
+                        return [[_normalize_calamine_value(v) for v in row[c0 - 1:c1]] for row in grid[r0 - 1:r1]]
+                    grid = sheet.to_python(skip_empty_area=False)
+                    rows = [[_normalize_calamine_value(v) for v in row] for row in grid]
+                    _put_calamine_sheet(key, rows, sum(len(row) for row in rows))
+        return [row[c0 - 1:c1] for row in rows[r0 - 1:r1]]
+
+    def read_tile(self, sheet_name: str, r0: int, r1: int, c0: int, c1: int):
+        """
+        Rows of raw values for a 1-based inclusive range.
+        Uses python-calamine when installed, openpyxl iter_rows otherwise.
+        """
+        if CalamineWorkbook is not None:
+            try:
+                return self._read_calamine_tile(sheet_name, r0, r1, c0, c1)
+            except Exception:
+                pass  # fall back to openpyxl below
+
+        return self.wb[sheet_name].iter_rows(
+            min_row=r0,
+            max_row=r1,
+            min_col=c0,
+            max_col=c1,
+            values_only=True
+        )
+
+    def acquire(self):
+        with self._users_lock:
+            self._users += 1
+
+    def release(self):
+        with self._users_lock:
+            self._users -= 1
+            close_now = self._evicted and self._users == 0
+        if close_now:
+            self._close()
+
+    def evict(self):
+        """Close now if idle, otherwise once the last in-flight request releases the workbook"""
+        with self._users_lock:
+            self._evicted = True
+            close_now = self._users == 0
+        if close_now:
+            self._close()
+
+    def _close(self):
+        _drop_calamine_sheets(self)
+        try:
+            self.wb.close()
+        except Exception:
+            pass
+        if self._calamine is not None:
+            try:
+                self._calamine.close()
+            except Exception:
+                pass
+
+
+def _get_workbook(path: str) -> _CachedWorkbook:
+    """
+    Return a cached read-only workbook for path, acquired for the caller, who must release() it.
+    Entries are invalidated when the file's mtime changes and closed on LRU eviction
+    once no request is reading them.
+    """
+    key = (path, os.path.getmtime(path))
+
+    with _workbook_cache_lock:
+        entry = _workbook_cache.get(key)
+        if entry is not None:
+            _workbook_cache.move_to_end(key)
+            # Acquired under the cache lock, so it cannot be evicted and closed in between
+            entry.acquire()
+            return entry
+
+    # Load outside the lock so a slow open doesn't block tiles of other files
+    loaded = _CachedWorkbook(path, load_workbook(path, read_only=True, data_only=True))
+
+    evicted = []
+    with _workbook_cache_lock:
+        entry = _workbook_cache.get(key)
+        if entry is not None:
+            # Another request opened it meanwhile
+            evicted.append(loaded)
+        else:
+            entry = loaded
+            for stale_key in [k for k in _workbook_cache if k[0] == path]:
+                evicted.append(_workbook_cache.pop(stale_key))
+            _workbook_cache[key] = entry
+            while len(_workbook_cache) > _WORKBOOK_CACHE_SIZE:
+                evicted.append(_workbook_cache.popitem(last=False)[1])
+        _workbook_cache.move_to_end(key)
+        entry.acquire()
+
+    for old in evicted:
+        old.evict()
+
+    return entry
+
+# Largest tile /page will build; the viewer asks for 1250 x 250 cell tiles
+_MAX_TILE_CELLS = 500_000
+
 # ---- Utilities --------------------------------------------------
-_A1_PATTERN = re.compile(r"^([A-Za-z]+)(\d+)$")
+_A1_PATTERN = re.compile(r"^([A-Za-z]{1,8})(\d+)$")
 
-def a1_to_rc(a1: str) -> Tuple[int, int]:
-    """Convert A1 notation (e.g., 'B5') to (row, col) 1-based indices"""
-    m = _A1_PATTERN.match(a1.strip())
-    if not m:
-        raise HTTPException(400, detail=f"Invalid A1 notation: {a1}")
+# Horner weights for up to 8 column letters, most significant first
+_A1_MAX_LETTERS = 8
+_POW26 = 26 ** np.arange(_A1_MAX_LETTERS, dtype=np.int64)[::-1]
+
+def a1_to_rc_batch(a1s: List[str]) -> np.ndarray:
+    """
+    Convert many A1 references to an (N, 2) array of 1-based (row, col).
+    Column letters are right-aligned into an N x 8 byte matrix ('@' pads to 0)
+    and decoded with a single dot product against powers of 26.
+    """
+    letters_list = []
+    rows = np.empty(len(a1s), dtype=np.int64)
+    for i, a1 in enumerate(a1s):
+        m = _A1_PATTERN.match(a1.strip())
+        if not m:
+            raise HTTPException(400, detail=f"Invalid A1 notation: {a1}")
+        letters, row = m.groups()
+        letters_list.append(letters.upper().rjust(_A1_MAX_LETTERS, "@"))
+        rows[i] = int(row)
     
-    letters, row = m.groups()
-    col = 0
-    for ch in letters.upper():
-        col = col * 26 + (ord(ch) - 64)
+    buf = "".join(letters_list).encode("ascii")
+    digits = np.frombuffer(buf, dtype=np.uint8).reshape(-1, _A1_MAX_LETTERS).astype(np.int64) - 64
+    cols = digits @ _POW26
     
-    return int(row), col
+    return np.column_stack((rows, cols))
+
+def a1_to_rc(a1: str) -> Tuple[int, int]:
+    """Convert A1 notation (e.g., 'B5') to (row, col) 1-based indices"""
+    r, c = a1_to_rc_batch([a1])[0]
+    return int(r), int(c)
 
 # ---- Schemas ----------------------------------------------------
 class SheetMeta(BaseModel):
@@ -79,6 +300,15 @@ class SpotlightResponse(BaseModel):
     row: int
     col: int
 
+class SpotlightCell(BaseModel):
+    cell: str
+    row: int
+    col: int
+
+class SpotlightBatchResponse(BaseModel):
+    sheet: str
+    cells: List[SpotlightCell]
+
 # ---- Endpoints --------------------------------------------------
 
 @router.get("/meta", response_model=MetaResponse)
@@ -88,24 +318,23 @@ def excel_meta(file_id: str):
     GET /api/excel/meta?file_id=xxx
     """
     path = resolve_excel_path(file_id)
+    cached = None
     
     try:
-        wb = load_workbook(path, read_only=True, data_only=True)
+        cached = _get_workbook(path)
         sheets = []
         
-        for sheet_name in wb.sheetnames:
-            ws = wb[sheet_name]
-            sheets.append(SheetMeta(
-                name=sheet_name,
-                rows=ws.max_row or 1,
-                cols=ws.max_column or 1
-            ))
+        for sheet_name in cached.wb.sheetnames:
+            rows, cols = cached.sheet_dims(sheet_name)
+            sheets.append(SheetMeta(name=sheet_name, rows=rows, cols=cols))
         
-        wb.close()
         return MetaResponse(file_id=file_id, sheets=sheets)
     
     except Exception as e:
         raise HTTPException(400, detail=f"Workbook open error: {str(e)}")
+    finally:
+        if cached is not None:
+            cached.release()
 
 
 @router.get("/page", response_model=PageResponse)
@@ -123,19 +352,31 @@ def excel_page(
     """
     if r1 < r0 or c1 < c0:
         raise HTTPException(400, detail="Invalid range: end must be >= start")
+    # Bound the request before any grid (even a blank one) is built from it
+    if (r1 - r0 + 1) * (c1 - c0 + 1) > _MAX_TILE_CELLS:
+        raise HTTPException(400, detail=f"Tile too large: at most {_MAX_TILE_CELLS} cells per request")
     
     path = resolve_excel_path(file_id)
+    cached = None
     
     try:
-        wb = load_workbook(path, read_only=True, data_only=True)
+        cached = _get_workbook(path)
         
-        if sheet not in wb.sheetnames:
-            wb.close()
+        if sheet not in cached.wb.sheetnames:
             raise HTTPException(404, detail=f"Sheet not found: {sheet}")
         
-        ws = wb[sheet]
-        max_r = ws.max_row or 1
-        max_c = ws.max_column or 1
+        max_r, max_c = cached.sheet_dims(sheet)
+        
+        # Tile lies entirely past the used range: answer with blanks without reading cells
+        if r0 > max_r or c0 > max_c:
+            return PageResponse(
+                sheet=sheet,
+                r0=r0,
+                r1=r1,
+                c0=c0,
+                c1=c1,
+                data=[[""] * (c1 - c0 + 1) for _ in range(r1 - r0 + 1)]
+            )
         
         # Clamp to actual bounds
         r0_clamped = max(1, min(r0, max_r))
@@ -143,19 +384,19 @@ def excel_page(
         c0_clamped = max(1, min(c0, max_c))
         c1_clamped = max(1, min(c1, max_c))
         
-        # Fetch data using iter_rows for efficiency
-        rows = ws.iter_rows(
-            min_row=r0_clamped,
-            max_row=r1_clamped,
-            min_col=c0_clamped,
-            max_col=c1_clamped,
-            values_only=True
-        )
+        rows = cached.read_tile(sheet, r0_clamped, r1_clamped, c0_clamped, c1_clamped)
         
-        # Convert to list, replacing None with empty string
-        data = [[("" if v is None else v) for v in row] for row in rows]
-        
-        wb.close()
+        # Fill a preallocated grid, then replace None with empty string in one pass
+        nr = r1_clamped - r0_clamped + 1
+        nc = c1_clamped - c0_clamped + 1
+        grid = np.empty((nr, nc), dtype=object)
+        for i, row in enumerate(rows):
+            if i >= nr:
+                break
+            row = row[:nc]
+            grid[i, :len(row)] = row
+        grid[grid == None] = ""  # noqa: E711 - elementwise mask on object array
+        data = grid.tolist()
         
         return PageResponse(
             sheet=sheet,
@@ -170,6 +411,9 @@ def excel_page(
         raise
     except Exception as e:
         raise HTTPException(400, detail=f"Read error: {str(e)}")
+    finally:
+        if cached is not None:
+            cached.release()
 
 
 @router.get("/spotlight", response_model=SpotlightResponse)
@@ -179,25 +423,62 @@ def excel_spotlight(file_id: str, sheet: str, cell: str):
     GET /api/excel/spotlight?file_id=xxx&sheet=Sheet1&cell=B5
     """
     path = resolve_excel_path(file_id)
+    cached = None
     
     try:
         r, c = a1_to_rc(cell)
         
-        wb = load_workbook(path, read_only=True, data_only=True)
+        cached = _get_workbook(path)
         
-        if sheet not in wb.sheetnames:
-            wb.close()
+        if sheet not in cached.wb.sheetnames:
             raise HTTPException(404, detail=f"Sheet not found: {sheet}")
         
-        ws = wb[sheet]
+        max_r, max_c = cached.sheet_dims(sheet)
         
         # Clamp to bounds
-        r = max(1, min(r, ws.max_row or 1))
-        c = max(1, min(c, ws.max_column or 1))
-        
-        wb.close()
+        r = max(1, min(r, max_r))
+        c = max(1, min(c, max_c))
         
         return SpotlightResponse(sheet=sheet, row=r, col=c)
     
     except Exception as e:
-        raise HTTPException(400, detail=f"Spotlight error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(400, detail=f"Spotlight error: {str(e)}")
+    finally:
+        if cached is not None:
+            cached.release()
+
+@router.get("/spotlight_batch", response_model=SpotlightBatchResponse)
+def excel_spotlight_batch(file_id: str, sheet: str, cells: List[str] = Query(...)):
+    """
+    Batched spotlight: resolve many cell references in one call.
+    GET /api/excel/spotlight_batch?file_id=xxx&sheet=Sheet1&cells=B5&cells=C10
+    """
+    path = resolve_excel_path(file_id)
+    cached = None
+    
+    try:
+        rc = a1_to_rc_batch(cells)
+        
+        cached = _get_workbook(path)
+        
+        if sheet not in cached.wb.sheetnames:
+            raise HTTPException(404, detail=f"Sheet not found: {sheet}")
+        
+        max_r, max_c = cached.sheet_dims(sheet)
+        
+        # Clamp to bounds
+        rc = np.clip(rc, 1, [max_r, max_c])
+        
+        return SpotlightBatchResponse(
+            sheet=sheet,
+            cells=[
+                SpotlightCell(cell=cell, row=int(r), col=int(c))
+                for cell, (r, c) in zip(cells, rc)
+            ]
+        )
+    
+    except Exception as e:
+        raise HTTPException(400, detail=f"Spotlight error: {str(e)}")
+    finally:
+        if cached is not None:
+            cached.release()
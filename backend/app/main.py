@@ -1009,7 +1009,7 @@ async def start_direct_audit(
         # Save results
         audit_session.audit_results = enhanced_audit_results
         audit_session.status = "completed"
-        audit_session.completion_date = datetime.utcnow()
+        audit_session.completion_date = end_time
         audit_session.comprehensive_audit_metadata.update({
             "completion_timestamp": end_time.isoformat(),
             "audit_duration_seconds": audit_duration
@@ -5,15 +5,20 @@ import json
 import structlog
 from app.config import settings
 from app.utils.metrics import track_ai_usage
+from app.services.audit.gemini_limiter import estimate_tokens, get_gemini_limiter
 import time
 
 logger = structlog.get_logger()
 
+_DECODER = json.JSONDecoder()
+
 class AIService:
     def __init__(self):
         if settings.GOOGLE_API_KEY:
             genai.configure(api_key=settings.GOOGLE_API_KEY)
             self.gemini_model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        # Shared with the audit services so every Gemini call counts against one quota
+        self.limiter = get_gemini_limiter()
         
         if settings.OPENAI_API_KEY:
             openai.api_key = settings.OPENAI_API_KEY
@@ -66,7 +71,7 @@ class AIService:
         """ + pdf_text
         
         try:
-            response = self.gemini_model.generate_content(prompt)
+            response = await self._generate(prompt, "pdf_extraction")
             result = self._parse_json_response(response.text)
             
             latency = (time.time() - start_time) * 1000
@@ -145,7 +150,7 @@ class AIService:
         """
         
         try:
-            response = self.gemini_model.generate_content(prompt)
+            response = await self._generate(prompt, "excel_extraction")
             result = self._parse_json_response(response.text)
             
             latency = (time.time() - start_time) * 1000
@@ -224,7 +229,7 @@ class AIService:
         """
         
         try:
-            response = self.gemini_model.generate_content(prompt)
+            response = await self._generate(prompt, "mapping_suggestion")
             result = self._parse_json_response(response.text)
             
             latency = (time.time() - start_time) * 1000
@@ -282,7 +287,7 @@ class AIService:
         """
         
         try:
-            response = self.gemini_model.generate_content(prompt)
+            response = await self._generate(prompt, "value_validation")
             result = self._parse_json_response(response.text)
             
             latency = (time.time() - start_time) * 1000
@@ -308,17 +313,24 @@ class AIService:
             logger.error("Value validation failed", error=str(e))
             raise
     
+    async def _generate(self, prompt: str, operation: str):
+        """Call Gemini without blocking the event loop, inside the shared rate limiter"""
+        return await self.limiter.call(
+            lambda: self.gemini_model.generate_content_async(prompt),
+            estimated_tokens=estimate_tokens(prompt),
+            context=operation
+        )
+    
     def _parse_json_response(self, response_text: str) -> Dict[str, Any]:
         """Parse JSON from AI response, handling markdown formatting"""
         try:
-            # Remove markdown code blocks if present
-            cleaned_text = response_text.strip()
-            if cleaned_text.startswith("```json"):
-                cleaned_text = cleaned_text[7:]
-            if cleaned_text.endswith("```"):
-                cleaned_text = cleaned_text[:-3]
+            # Skip any markdown fence or preamble before the object; raw_decode ignores what follows it
+            json_start = response_text.find('{')
+            if json_start == -1:
+                raise json.JSONDecodeError("No JSON object found", response_text, 0)
             
-            return json.loads(cleaned_text.strip())
+            result, _ = _DECODER.raw_decode(response_text, json_start)
+            return result
         except json.JSONDecodeError as e:
             logger.error("Failed to parse AI response as JSON", response=response_text, error=str(e))
             raise ValueError(f"Invalid JSON response from AI: {str(e)}")
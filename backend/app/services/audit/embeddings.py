@@ -0,0 +1,49 @@
+import threading
+from typing import List
+
+import google.generativeai as genai
+import numpy as np
+import structlog
+from decouple import config
+
+# Configure logging
+logger = structlog.get_logger()
+
+# "gemini" embeds through the API; "local" runs a sentence-transformers model in-process (no network hop).
+# Context and query vectors must come from the same model, so changing this requires rebuilding the FAISS index.
+EMBEDDING_BACKEND = config('EMBEDDING_BACKEND', default='gemini')
+GEMINI_EMBEDDING_MODEL = 'models/embedding-001'
+LOCAL_EMBEDDING_MODEL = config('LOCAL_EMBEDDING_MODEL', default='all-MiniLM-L6-v2')
+LOCAL_EMBEDDING_BATCH_SIZE = 64
+
+_local_model = None
+_local_model_lock = threading.Lock()
+
+
+def embedding_model_id() -> str:
+    """Name of the model behind the vectors; saved with the FAISS index and checked when it is loaded"""
+    if EMBEDDING_BACKEND == 'local':
+        return f"local:{LOCAL_EMBEDDING_MODEL}"
+    return GEMINI_EMBEDDING_MODEL
+
+
+def _get_local_model():
+    global _local_model
+    with _local_model_lock:
+        if _local_model is None:
+            # Optional dependency, only needed with EMBEDDING_BACKEND=local
+            from sentence_transformers import SentenceTransformer
+            _local_model = SentenceTransformer(LOCAL_EMBEDDING_MODEL)
+            logger.info(f"Loaded local embedding model {LOCAL_EMBEDDING_MODEL}")
+        return _local_model
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts with the configured backend into an (N, D) float32 matrix; blocking"""
+    if EMBEDDING_BACKEND == 'local':
+        embeddings = _get_local_model().encode(
+            texts, batch_size=LOCAL_EMBEDDING_BATCH_SIZE, convert_to_numpy=True
+        )
+        return embeddings.astype(np.float32, copy=False)
+    result = genai.embed_content(model=GEMINI_EMBEDDING_MODEL, content=texts)
+    return np.asarray(result['embedding'], dtype=np.float32)
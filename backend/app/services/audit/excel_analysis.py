@@ -2,10 +2,15 @@ import pandas as pd
 import numpy as np
 import openpyxl
 from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
 import faiss
 import re
 import os
+import sys
 import json
+import orjson
+import math
+from array import array
 from typing import List, Dict, Any, Tuple, Optional
 from dataclasses import dataclass
 import google.generativeai as genai
@@ -15,12 +20,65 @@ from pathlib import Path
 import time
 from decouple import config
 import structlog
+from app.services.audit.embeddings import embed_texts, embedding_model_id
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
-import numpy as np
 
 # Configure logging
 logger = structlog.get_logger()
 
+# Sheets are analysed in threads sharing one loaded workbook; only very large
+# workbooks (many multi-MB sheets) are worth the process startup + re-parse cost.
+MAX_SHEET_THREADS = 8
+PROCESS_POOL_MIN_SHEETS = 16
+PROCESS_POOL_MIN_BYTES_PER_SHEET = 2 * 1024 * 1024
+
+# Gemini embed_content accepts up to 100 texts per request (the local backend batches internally)
+EMBED_BATCH_SIZE = 100
+EMBED_MAX_RETRIES = 5
+EMBED_RETRY_BASE_DELAY = 1.0
+
+# FAISS index selection thresholds (vectors are L2-normalized, so inner product = cosine)
+FLAT_INDEX_MAX_VECTORS = 2048
+HNSW_INDEX_MAX_VECTORS = 200_000
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+FAISS_INDEX_META_PATH = "faiss_db/faiss_index.meta.json"
+
+# Tables with fewer numeric cells than this share are notes/instructions: no contexts, no embeddings
+NUMERIC_TABLE_MIN_RATIO = 0.1
+
+_COL_LETTER_CACHE: Dict[int, str] = {}
+
+# Reused across index builds and loads so GPU memory isn't reallocated per call
+_gpu_resources = None
+
+
+def maybe_index_to_gpu(faiss_index, index_type: str):
+    """Move the index to GPU 0 when FAISS_GPU is set and a GPU is available"""
+    global _gpu_resources
+    if not config('FAISS_GPU', default=False, cast=bool):
+        return faiss_index
+    if index_type.startswith("hnsw") or not hasattr(faiss, "get_num_gpus") or faiss.get_num_gpus() == 0:
+        # HNSW has no GPU implementation; faiss-cpu builds have no GPU support
+        return faiss_index
+
+    try:
+        if _gpu_resources is None:
+            _gpu_resources = faiss.StandardGpuResources()
+        gpu_index = faiss.index_cpu_to_gpu(_gpu_resources, 0, faiss_index)
+        logger.info(f"FAISS {index_type} index moved to GPU")
+        return gpu_index
+    except Exception as e:
+        logger.warning(f"Failed to move FAISS index to GPU, staying on CPU: {e}")
+        return faiss_index
+
+def col_letter(col_idx: int) -> str:
+    """Cached 1-based column index -> Excel column letter"""
+    letter = _COL_LETTER_CACHE.get(col_idx)
+    if letter is None:
+        letter = _COL_LETTER_CACHE[col_idx] = get_column_letter(col_idx)
+    return letter
+
 @dataclass
 class CellContext:
     """Data class to store cell context information"""
@@ -87,16 +145,36 @@ class ExcelAuditSystem:
             'growth': r'^[+-]?[\d.,]+%?$',
             'integer': r'^[\d,]+$'
         }
+        self._compiled_patterns = {
+            data_type: re.compile(pattern, re.IGNORECASE)
+            for data_type, pattern in self.data_patterns.items()
+        }
+        self._financial_keyword_re = re.compile(r'ratio|growth|mix|profit|revenue|pbt', re.IGNORECASE)
+        # Union of all patterns for a single-call numeric check
+        self._numeric_re = re.compile(
+            "|".join(f"(?:{pattern})" for pattern in self.data_patterns.values()), re.IGNORECASE
+        )
 
-    def process_sheet(self, excel_file_path: str, sheet_name: str) -> Tuple[str, List[CellContext], int]:
+    def process_sheet(self, excel_file_path: str, sheet_name: str, workbook=None) -> Tuple[str, List[CellContext], int]:
         """Process one sheet: detect tables, extract contexts"""
-        workbook = load_workbook(excel_file_path, data_only=True)
-        worksheet = workbook[sheet_name]
-
-        tables = self._detect_tables(worksheet)
+        owns_workbook = workbook is None
+        if owns_workbook:
+            workbook = load_workbook(excel_file_path, data_only=True, read_only=True)
+        try:
+            grid, non_empty_cells, coordinates = self._materialize_sheet(workbook[sheet_name])
+        finally:
+            if owns_workbook:
+                workbook.close()
+        tables = self._detect_tables(grid, non_empty_cells, coordinates)
         contexts = []
+        skipped = 0
         for table in tables:
-            contexts.extend(self._extract_context(worksheet, table, sheet_name))
+            if not self._has_numeric_content(table):
+                skipped += 1
+                continue
+            contexts.extend(self._extract_context(grid, table, sheet_name))
+        if skipped:
+            logger.info(f"Sheet {sheet_name}: skipped {skipped} text-only tables")
 
         return (sheet_name, contexts, len(tables))
 
@@ -111,9 +189,14 @@ class ExcelAuditSystem:
             self.embeddings.clear()
             self.faiss_index = None
 
-            workbook = load_workbook(excel_file_path, data_only=True)
-            sheetnames = workbook.sheetnames
-            del workbook  # free memory since each process loads workbook separately
+            names_workbook = load_workbook(excel_file_path, read_only=True)
+            sheetnames = names_workbook.sheetnames
+            names_workbook.close()
+            bytes_per_sheet = os.path.getsize(excel_file_path) / max(1, len(sheetnames))
+            use_processes = (
+                len(sheetnames) > PROCESS_POOL_MIN_SHEETS
+                and bytes_per_sheet > PROCESS_POOL_MIN_BYTES_PER_SHEET
+            )
 
             analysis_results = {
                 'file_path': excel_file_path,
@@ -125,17 +208,33 @@ class ExcelAuditSystem:
             }
 
             # 🔹 Parallel across sheets
-            from concurrent.futures import ProcessPoolExecutor, as_completed
-            with ProcessPoolExecutor() as executor:
-                futures = {executor.submit(self.process_sheet, excel_file_path, sheet): sheet for sheet in sheetnames}
-
-                for f in as_completed(futures):
-                    sheet_name, contexts, tables_count = f.result()
-                    self.context_database.extend(contexts)
-                    analysis_results['contexts_extracted'] += len(contexts)
-                    analysis_results['tables_detected'] += tables_count
-                    analysis_results['sheets_processed'] += 1
-                    logger.info(f"Finished sheet: {sheet_name} | Contexts: {len(contexts)}")
+            if use_processes:
+                # Each worker process reloads the workbook itself
+                executor = ProcessPoolExecutor()
+                workbook = None
+            else:
+                executor = ThreadPoolExecutor(max_workers=max(1, min(MAX_SHEET_THREADS, len(sheetnames))))
+                # read_only streams rows from the XML instead of building the full cell DOM
+                workbook = load_workbook(excel_file_path, data_only=True, read_only=True)
+
+            try:
+                with executor:
+                    futures = {
+                        executor.submit(self.process_sheet, excel_file_path, sheet, workbook): sheet
+                        for sheet in sheetnames
+                    }
+
+                    for f in as_completed(futures):
+                        sheet_name, contexts, tables_count = f.result()
+                        self.context_database.extend(contexts)
+                        analysis_results['contexts_extracted'] += len(contexts)
+                        analysis_results['tables_detected'] += tables_count
+                        analysis_results['sheets_processed'] += 1
+                        logger.info(f"Finished sheet: {sheet_name} | Contexts: {len(contexts)}")
+            finally:
+                # Also closed when a sheet fails; the executor has already waited for the other sheets
+                if workbook is not None:
+                    workbook.close()
 
             # 🔹 Embedding creation (parallelized)
             if self.context_database:
@@ -148,8 +247,10 @@ class ExcelAuditSystem:
             # Save contexts JSON
             context_json_path = "faiss_db/contexts.json"
             os.makedirs(os.path.dirname(context_json_path), exist_ok=True)
-            with open(context_json_path, "w", encoding="utf-8") as f:
-                json.dump([c.__dict__ for c in self.context_database], f, ensure_ascii=False, indent=4, default=str)
+            # orjson serializes straight to UTF-8 bytes; minified to keep the file small
+            Path(context_json_path).write_bytes(
+                orjson.dumps([c.__dict__ for c in self.context_database], default=str)
+            )
             logger.info(f"Contexts saved to {context_json_path}")
 
             return AnalysisResult(
@@ -162,26 +263,51 @@ class ExcelAuditSystem:
             logger.error(f"Error in comprehensive analysis: {str(e)}")
             raise  # 🔑 don’t return dict, let caller catch
 
-    def _detect_tables(self, worksheet) -> List[Dict[str, Any]]:
+    def _materialize_sheet(self, worksheet) -> Tuple[np.ndarray, List[Tuple], np.ndarray]:
+        """
+        Read the worksheet once into a dense (rows x cols) object grid.
+        Also returns the non-empty cells as (row, col, value) with 1-based indices,
+        and their coordinates as an (N, 2) int array built in the same pass.
+        """
+        max_row = worksheet.max_row
+        max_col = worksheet.max_column
+        if max_row and max_col:
+            # Stream rows straight into the grid so only one copy of the sheet is alive
+            rows = worksheet.iter_rows(min_row=1, max_row=max_row, min_col=1, max_col=max_col, values_only=True)
+        else:
+            # Unsized read-only sheet (no dimension record): buffer the rows once to learn the size
+            rows = list(worksheet.iter_rows(values_only=True))
+            max_row = len(rows) or 1
+            max_col = max(map(len, rows), default=0) or 1
+        grid = np.empty((max_row, max_col), dtype=object)
+        non_empty_cells = []
+        coords = array('i')
+
+        for row_idx, row in enumerate(rows, start=1):
+            grid[row_idx - 1, :len(row)] = row
+            for col_idx, value in enumerate(row, start=1):
+                if value is not None and str(value).strip():
+                    non_empty_cells.append((row_idx, col_idx, value))
+                    coords.append(row_idx)
+                    coords.append(col_idx)
+
+        coordinates = np.frombuffer(coords, dtype=np.intc).reshape(-1, 2)
+
+        return grid, non_empty_cells, coordinates
+
+    def _detect_tables(self, grid: np.ndarray, non_empty_cells: List[Tuple],
+                       coordinates: np.ndarray) -> List[Dict[str, Any]]:
         """Multi-stage table detection"""
         tables = []
 
-        # Get all non-empty cells
-        non_empty_cells = []
-        for row in worksheet.iter_rows():
-            for cell in row:
-                if cell.value is not None and str(cell.value).strip():
-                    non_empty_cells.append((cell.row, cell.column, cell.value))
-
         if not non_empty_cells:
             return tables
 
-        # Stage 1: Find data regions using clustering
-        coordinates = np.array([(row, col) for row, col, _ in non_empty_cells])
+        # Stage 1: Find data regions using clustering on the (row, col) coordinates
 
         if len(coordinates) > 5:
             try:
-                clustering = DBSCAN(eps=3, min_samples=3).fit(coordinates)
+                clustering = DBSCAN(eps=3, min_samples=3, algorithm='kd_tree', n_jobs=-1).fit(coordinates)
                 labels = clustering.labels_
 
                 # Group cells by cluster
@@ -228,15 +354,26 @@ class ExcelAuditSystem:
             'size': len(cells)
         }
 
+    def _has_numeric_content(self, table: Dict[str, Any]) -> bool:
+        """True when enough of the table's cells are numbers to be worth auditing"""
+        numeric_count = 0
+        for _, _, value in table['cells']:
+            if isinstance(value, str):
+                numeric_count += self._numeric_re.match(value.strip()) is not None
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                numeric_count += 1
+        return numeric_count >= NUMERIC_TABLE_MIN_RATIO * len(table['cells'])
+
     def _classify_table_type(self, cells: List[Tuple]) -> str:
         """Classify table type based on content patterns"""
-        values = [str(cell[2]).lower() for cell in cells if cell[2] is not None]
+        # No lowercasing needed: the keyword regex is case-insensitive and '%' has no case
+        values = [str(cell[2]) for cell in cells if cell[2] is not None]
 
-        # Check for financial indicators
-        financial_keywords = ['ratio', 'growth', 'mix', 'profit', 'revenue', 'pbt']
+        # Check for financial indicators (short-circuits on the first hit)
+        has_financial = any(self._financial_keyword_re.search(v) for v in values)
         percentage_count = sum(1 for v in values if '%' in v)
 
-        if any(keyword in ' '.join(values) for keyword in financial_keywords):
+        if has_financial:
             if percentage_count > len(values) * 0.3:
                 return 'financial_ratios'
             else:
@@ -246,30 +383,40 @@ class ExcelAuditSystem:
         else:
             return 'data_table'
 
-    def _extract_context(self, worksheet, table: Dict[str, Any], sheet_name: str) -> List[CellContext]:
+    def _extract_context(self, grid: np.ndarray, table: Dict[str, Any], sheet_name: str) -> List[CellContext]:
         """Hierarchical context building for each cell"""
         contexts = []
 
         # Find table title
-        table_title = self._get_table_title(worksheet, table)
+        table_title = self._get_table_title(grid, table)
+
+        # Headers depend only on the row (or column), so resolve them once per table
+        row_header_cache = {
+            row_idx: self._get_row_hierarchy(grid, table, row_idx)
+            for row_idx in range(table['min_row'], table['max_row'] + 1)
+        }
+        col_header_cache = {
+            col_idx: self._get_col_hierarchy(grid, table, col_idx)
+            for col_idx in range(table['min_col'], table['max_col'] + 1)
+        }
 
         # Process each cell in the table
         for row_idx in range(table['min_row'], table['max_row'] + 1):
             for col_idx in range(table['min_col'], table['max_col'] + 1):
-                cell = worksheet.cell(row=row_idx, column=col_idx)
+                value = grid[row_idx - 1, col_idx - 1]
 
-                if cell.value is not None:
+                if value is not None:
                     # Get hierarchical headers
-                    row_headers = self._get_row_hierarchy(worksheet, table, row_idx)
-                    col_headers = self._get_col_hierarchy(worksheet, table, col_idx)
+                    row_headers = row_header_cache[row_idx]
+                    col_headers = col_header_cache[col_idx]
 
                     # Classify data type
-                    data_type = self._classify_data_types(cell.value)
+                    data_type = self._classify_data_types(value)
 
                     # Build full context string
                     full_context = self._build_context_string(
                         sheet_name, table_title, row_headers, col_headers, 
-                        cell.value, data_type, table['type']
+                        value, data_type, table['type']
                     )
 
                     context = CellContext(
@@ -277,9 +424,9 @@ class ExcelAuditSystem:
                         table_title=table_title,
                         row_headers=row_headers,
                         col_headers=col_headers,
-                        value=cell.value,
+                        value=value,
                         data_type=data_type,
-                        cell_address=f"{cell.column_letter}{cell.row}",
+                        cell_address=f"{col_letter(col_idx)}{row_idx}",
                         full_context=full_context
                     )
 
@@ -287,51 +434,51 @@ class ExcelAuditSystem:
 
         return contexts
 
-    def _get_table_title(self, worksheet, table: Dict[str, Any]) -> str:
+    def _get_table_title(self, grid: np.ndarray, table: Dict[str, Any]) -> str:
         """Extract table title from above the table region"""
         # Look 1-3 rows above the table for title
         for row_offset in range(1, 4):
             title_row = table['min_row'] - row_offset
             if title_row > 0:
                 for col_idx in range(table['min_col'], table['max_col'] + 1):
-                    cell = worksheet.cell(row=title_row, column=col_idx)
-                    if cell.value and isinstance(cell.value, str):
-                        title = str(cell.value).strip()
+                    value = grid[title_row - 1, col_idx - 1]
+                    if value and isinstance(value, str):
+                        title = str(value).strip()
                         if len(title) > 3 and not title.replace('.', '').isdigit():
-                            return title
+                            return sys.intern(title)
 
         return f"Table_{table['min_row']}_{table['min_col']}"
 
-    def _get_row_hierarchy(self, worksheet, table: Dict[str, Any], row_idx: int) -> List[str]:
+    def _get_row_hierarchy(self, grid: np.ndarray, table: Dict[str, Any], row_idx: int) -> List[str]:
         """Get hierarchical row headers"""
         headers = []
 
         # Check leftmost columns for row headers
         for col_offset in range(min(3, table['max_col'] - table['min_col'] + 1)):
             col_idx = table['min_col'] + col_offset
-            cell = worksheet.cell(row=row_idx, column=col_idx)
+            value = grid[row_idx - 1, col_idx - 1]
 
-            if cell.value and isinstance(cell.value, str):
-                header = str(cell.value).strip()
+            if value and isinstance(value, str):
+                header = str(value).strip()
                 if header and not self._is_numeric_value(header):
-                    headers.append(header)
+                    headers.append(sys.intern(header))
                     break
 
         return headers if headers else ['Unknown_Row']
 
-    def _get_col_hierarchy(self, worksheet, table: Dict[str, Any], col_idx: int) -> List[str]:
+    def _get_col_hierarchy(self, grid: np.ndarray, table: Dict[str, Any], col_idx: int) -> List[str]:
         """Get hierarchical column headers"""
         headers = []
 
         # Check top rows for column headers
         for row_offset in range(min(3, table['max_row'] - table['min_row'] + 1)):
             row_idx = table['min_row'] + row_offset
-            cell = worksheet.cell(row=row_idx, column=col_idx)
+            value = grid[row_idx - 1, col_idx - 1]
 
-            if cell.value and isinstance(cell.value, str):
-                header = str(cell.value).strip()
+            if value and isinstance(value, str):
+                header = str(value).strip()
                 if header and not self._is_numeric_value(header):
-                    headers.append(header)
+                    headers.append(sys.intern(header))
                     break
 
         return headers if headers else ['Unknown_Col']
@@ -343,9 +490,9 @@ class ExcelAuditSystem:
 
         value_str = str(value).strip()
 
-        # Check each pattern (using raw strings to fix regex)
-        for data_type, pattern in self.data_patterns.items():
-            if re.match(pattern, value_str, re.IGNORECASE):
+        # Check each pattern in priority order
+        for data_type, pattern in self._compiled_patterns.items():
+            if pattern.match(value_str):
                 return data_type
 
         # Check for text
@@ -356,10 +503,7 @@ class ExcelAuditSystem:
 
     def _is_numeric_value(self, value_str: str) -> bool:
         """Check if string represents a numeric value"""
-        for pattern in self.data_patterns.values():
-            if re.match(pattern, value_str, re.IGNORECASE):
-                return True
-        return False
+        return self._numeric_re.match(value_str) is not None
 
     def _build_context_string(self, sheet_name: str, table_title: str, 
                              row_headers: List[str], col_headers: List[str], 
@@ -378,56 +522,107 @@ class ExcelAuditSystem:
         return " | ".join(context_parts)
 
     def _create_embeddings(self) -> None:
-        """Generate Gemini embeddings for all contexts using threading"""
+        """Generate embeddings for all contexts in batched requests"""
         logger.info("Creating embeddings for contexts...")
 
-        texts = [c.full_context for c in self.context_database]
-        self.embeddings = []
+        # Identical context strings (e.g. cloned template tables) are embedded once
+        texts = list(dict.fromkeys(c.full_context for c in self.context_database))
+        if len(texts) < len(self.context_database):
+            logger.info(f"Embedding {len(texts)} unique contexts out of {len(self.context_database)}")
+        unique_embeddings = []
+
+        def embed_batch(batch_texts):
+            """Embed up to EMBED_BATCH_SIZE texts in one request, retrying with backoff"""
+            for attempt in range(EMBED_MAX_RETRIES):
+                try:
+                    return embed_texts(batch_texts)
+                except Exception as e:
+                    if attempt == EMBED_MAX_RETRIES - 1:
+                        logger.error(f"Embedding batch failed after {EMBED_MAX_RETRIES} attempts: {e}")
+                        raise
+                    delay = EMBED_RETRY_BASE_DELAY * (2 ** attempt)
+                    logger.warning(f"Embedding batch failed ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+
+        batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+
+        # executor.map yields in submission order, keeping embeddings aligned with contexts
+        with ThreadPoolExecutor(max_workers=4) as executor:  # tune workers based on API rate limit
+            for batch_embeddings in executor.map(embed_batch, batches):
+                unique_embeddings.extend(batch_embeddings)
+                logger.info(f"Generated {len(unique_embeddings)} embeddings...")
+
+        # Expand back to one embedding per context, in context order
+        embedding_by_text = dict(zip(texts, unique_embeddings))
+        self.embeddings = [embedding_by_text[c.full_context] for c in self.context_database]
 
-        def embed_text(text):
-            try:
-                result = genai.embed_content(model="models/embedding-001", content=text)
-                return result['embedding']
-            except Exception as e:
-                logger.error(f"Embedding failed: {e}")
-                return np.random.rand(768).tolist()  # fallback random vec
+        logger.info(f"Generated total {len(self.embeddings)} embeddings")
+
+    def _create_faiss_index(self, dimension: int, n_vectors: int) -> Tuple[Any, str]:
+        """
+        Pick an inner-product index for the number of vectors:
+        exact Flat for small sets, HNSW graph for medium, IVF partitions for large.
+        Medium/large indexes store vectors as 8-bit scalar-quantized codes (4x smaller).
+        """
+        if n_vectors < FLAT_INDEX_MAX_VECTORS:
+            return faiss.IndexFlatIP(dimension), "flat"
 
-        with ThreadPoolExecutor(max_workers=10) as executor:  # tune workers based on API rate limit
-            futures = {executor.submit(embed_text, t): t for t in texts}
-            for i, f in enumerate(as_completed(futures)):
-                emb = f.result()
-                self.embeddings.append(emb)
-                if i % 50 == 0:
-                    logger.info(f"Generated {i} embeddings...")
+        if n_vectors < HNSW_INDEX_MAX_VECTORS:
+            index = faiss.IndexHNSWSQ(
+                dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+            )
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+            return index, "hnsw_sq8"
 
-        logger.info(f"Generated total {len(self.embeddings)} embeddings")
+        nlist = int(4 * math.sqrt(n_vectors))
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFScalarQuantizer(
+            quantizer, dimension, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+        index.nprobe = max(1, nlist // 16)
+        return index, "ivf_sq8"
 
     def _build_faiss_index(self) -> None:
         """Optimize for similarity search using FAISS"""
         if not self.embeddings:
             raise ValueError("No embeddings available to build index")
 
-        # Convert embeddings to numpy array
-        embedding_matrix = np.array(self.embeddings).astype('float32')
+        # Index position i must map back to context_database[i]
+        if len(self.embeddings) != len(self.context_database):
+            raise ValueError(
+                f"Embeddings ({len(self.embeddings)}) are not aligned with contexts ({len(self.context_database)})"
+            )
 
-        # Create FAISS index
-        dimension = embedding_matrix.shape[1]
-        faiss_index = faiss.IndexFlatIP(dimension)
+        # Fill a preallocated float32 matrix (avoids a float64 intermediate copy)
+        embedding_matrix = np.empty((len(self.embeddings), len(self.embeddings[0])), dtype=np.float32)
+        for i, embedding in enumerate(self.embeddings):
+            embedding_matrix[i] = embedding
 
         # Normalize vectors for cosine similarity
         faiss.normalize_L2(embedding_matrix)
 
+        # Create FAISS index sized to the context database
+        dimension = embedding_matrix.shape[1]
+        faiss_index, index_type = self._create_faiss_index(dimension, embedding_matrix.shape[0])
+
+        if not faiss_index.is_trained:
+            faiss_index.train(embedding_matrix)
+
         # Add embeddings to index
         faiss_index.add(embedding_matrix)
 
-        logger.info(f"FAISS index built with {faiss_index.ntotal} vectors")
+        logger.info(f"FAISS {index_type} index built with {faiss_index.ntotal} vectors")
         save_path = "faiss_db/faiss_index.index"
         os.makedirs(os.path.dirname(save_path), exist_ok=True)
         
         faiss.write_index(faiss_index, save_path)
+        with open(FAISS_INDEX_META_PATH, "w", encoding="utf-8") as f:
+            json.dump({"index_type": index_type, "dimension": dimension, "ntotal": faiss_index.ntotal,
+                       "embedding_model": embedding_model_id()}, f)
         logger.info(f"FAISS index saved to {save_path}")
 
-        return faiss_index
+        # The persisted copy above stays CPU-portable; serve queries from GPU when enabled
+        return maybe_index_to_gpu(faiss_index, index_type)
 
 # Usage Example:
 def main():
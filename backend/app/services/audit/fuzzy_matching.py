@@ -1,18 +1,83 @@
 # fuzzy_match_service.py
 import pandas as pd
 import numpy as np
-from fuzzywuzzy import fuzz, process
+from rapidfuzz import fuzz, process, utils
+from rapidfuzz.distance import Levenshtein
 import structlog
 from typing import Dict, Any, List, Tuple, Optional
 import json
+import heapq
+import asyncio
+import threading
+from collections import OrderedDict, defaultdict
+import math
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 
 logger = structlog.get_logger()
 
+# Number of distinct normalized PDF strings whose fuzzy hits are remembered
+FUZZY_CACHE_SIZE = 4096
+
+# Context candidates must share this fraction of the PDF context's tokens/trigrams
+CONTEXT_TOKEN_OVERLAP = 0.3
+# At most this many best-overlapping rows are scored with partial_ratio per PDF context
+CONTEXT_CANDIDATE_LIMIT = 256
+
+
+# str.translate tables: drop formatting characters in a single C pass
+_EXACT_STRIP_TABLE = str.maketrans('', '', ', ')
+_NUMERIC_STRIP_TABLE = str.maketrans('', '', ',%')
+# Only digit grouping and whitespace: '%', currency signs and brackets change what a figure means
+_DECIMAL_STRIP_TABLE = str.maketrans('', '', ', \t\n')
+
+# Exact numeric matches are only trusted without LLM review for values with this many digits
+LOCAL_MATCH_MIN_DIGITS = 3
+
+
+def _trigram_bloom(text: str) -> int:
+    """64-bit bloom signature of a string's character trigrams"""
+    bits = 0
+    for i in range(len(text) - 2):
+        bits |= 1 << (hash(text[i:i + 3]) & 63)
+    return bits
+
+
+# Words too common in financial labels to say anything about which rows are related
+_CONTEXT_STOPWORDS = frozenset({
+    "a", "an", "and", "as", "at", "by", "for", "from", "in", "is", "of", "on", "or", "the", "to", "vs", "with"
+})
+
+
+def _context_tokens(text: str) -> set:
+    """Word tokens (minus stopwords) plus character trigrams of an already default_process-ed context string"""
+    tokens = set(text.split())
+    tokens -= _CONTEXT_STOPWORDS
+    tokens.update(text[i:i + 3] for i in range(len(text) - 2))
+    return tokens
+
 class FuzzyMatchService:
     def __init__(self, similarity_threshold: float = 0.85):
         self.similarity_threshold = similarity_threshold
         self.excel_data = None
+        # Column-wise (SoA) views of excel_data, precomputed once per load
+        self._excel_strs: List[str] = []
+        self._excel_norm: np.ndarray = np.empty(0, dtype=object)
+        # normalized value -> excel indices, for O(1) exact matching
+        self._exact_index: Dict[str, List[int]] = {}
+        self._excel_num: np.ndarray = np.empty(0, dtype=np.float64)
+        self._excel_proc: np.ndarray = np.empty(0, dtype=object)
+        self._excel_lens: np.ndarray = np.empty(0, dtype=np.int32)
+        self._excel_bloom: np.ndarray = np.empty(0, dtype=np.uint64)
+        # default_process(full_context + ' ' + table_title) per row, shared by the index and scoring
+        self._excel_contexts: np.ndarray = np.empty(0, dtype=object)
+        # default_process(pdf string) -> {excel index: similarity}, LRU ordered
+        self._fuzzy_cache: "OrderedDict[str, Dict[int, float]]" = OrderedDict()
+        self._fuzzy_cache_lock = threading.Lock()
+        # token/trigram -> array of excel indices whose context contains it
+        self._token_postings: Dict[str, np.ndarray] = {}
+        # exact Decimal value -> excel indices ("1,234" and "1234.00" share a key)
+        self._decimal_index: Dict[Decimal, List[int]] = {}
         logger.info("Fuzzy Match Service initialized")
     
     def load_excel_data(self, contexts: List[Dict]) -> bool:
@@ -28,158 +93,307 @@ class FuzzyMatchService:
                     'sheet_name': ctx.get('sheet_name', ''),
                     'data_type': ctx.get('data_type', '')
                 })
+            
+            self._excel_strs = [str(item['value']) for item in self.excel_data]
+            self._excel_norm = np.array([self._normalize_exact(v) for v in self._excel_strs], dtype=object)
+            exact_index = defaultdict(list)
+            for j, (value, norm) in enumerate(zip(self._excel_strs, self._excel_norm)):
+                if value:
+                    exact_index[norm].append(j)
+            self._exact_index = dict(exact_index)
+            decimal_index = defaultdict(list)
+            for j, value in enumerate(self._excel_strs):
+                key = self._to_decimal(value)
+                if key is not None:
+                    decimal_index[key].append(j)
+            self._decimal_index = dict(decimal_index)
+            self._excel_num = self._parse_numeric_column(self._excel_strs)
+            self._excel_proc = np.array([utils.default_process(v) for v in self._excel_strs], dtype=object)
+            self._excel_lens = np.array([len(v) for v in self._excel_proc], dtype=np.int32)
+            self._excel_bloom = np.array([_trigram_bloom(v) for v in self._excel_proc], dtype=np.uint64)
+            self._excel_contexts = np.array([
+                utils.default_process((item.get('full_context') or '') + ' ' + (item.get('table_title') or ''))
+                for item in self.excel_data
+            ], dtype=object)
+            self._fuzzy_cache.clear()
+            self._build_token_postings()
+            
             logger.info(f"Loaded {len(self.excel_data)} Excel records for fuzzy matching")
             return True
         except Exception as e:
             logger.error(f"Failed to load Excel data for fuzzy matching: {e}")
             return False
     
+    def _build_token_postings(self) -> None:
+        """Inverted index from context tokens/trigrams to Excel row indices"""
+        postings = defaultdict(list)
+        for j, excel_context in enumerate(self._excel_contexts):
+            for token in _context_tokens(excel_context):
+                postings[token].append(j)
+        self._token_postings = {token: np.array(idx, dtype=np.int32) for token, idx in postings.items()}
+    
+    def _context_candidates(self, pdf_context: str) -> np.ndarray:
+        """
+        Excel rows sharing enough tokens/trigrams with the PDF context to be worth scoring.
+        pdf_context must already be default_process-ed.
+        """
+        pdf_tokens = _context_tokens(pdf_context)
+        hit_lists = [self._token_postings[t] for t in pdf_tokens if t in self._token_postings]
+        if not hit_lists:
+            return np.empty(0, dtype=np.int32)
+        
+        overlap = np.bincount(np.concatenate(hit_lists), minlength=len(self.excel_data))
+        candidates = np.nonzero(overlap >= CONTEXT_TOKEN_OVERLAP * len(pdf_tokens))[0]
+        if len(candidates) > CONTEXT_CANDIDATE_LIMIT:
+            # Keep the top-k by overlap (O(n) partition, no full sort), then restore row order
+            top = np.argpartition(overlap[candidates], -CONTEXT_CANDIDATE_LIMIT)[-CONTEXT_CANDIDATE_LIMIT:]
+            candidates = np.sort(candidates[top])
+        return candidates
+    
     async def fuzzy_match_batch(self, pdf_batch: List[Dict]) -> List[Dict]:
         """Perform fuzzy matching on a batch of PDF values"""
         if not self.excel_data:
             logger.warning("No Excel data loaded for fuzzy matching")
             return []
         
-        fuzzy_results = []
+        # Extract and normalize each PDF field once per batch
+        pdf_strs = [str(pdf_value.get('value', '')) for pdf_value in pdf_batch]
+        pdf_contexts = [pdf_value.get('business_context', {}).get('semantic_meaning', '') for pdf_value in pdf_batch]
+        pdf_categories = [pdf_value.get('business_context', {}).get('business_category', '') for pdf_value in pdf_batch]
+        fuzzy_hits = await asyncio.to_thread(
+            self._get_fuzzy_hits, [utils.default_process(v) for v in pdf_strs]
+        )
         
-        for pdf_value in pdf_batch:
-            pdf_val_str = str(pdf_value.get('value', ''))
-            pdf_context = pdf_value.get('business_context', {}).get('semantic_meaning', '')
-            pdf_category = pdf_value.get('business_context', {}).get('business_category', '')
-            
-            matches = await self._find_fuzzy_matches(
-                pdf_val_str, 
-                pdf_context, 
-                pdf_category
+        # Matching is CPU-bound and RapidFuzz releases the GIL, so fan values out to worker threads
+        all_matches = await asyncio.gather(*[
+            asyncio.to_thread(
+                self._find_fuzzy_matches, pdf_strs[i], pdf_contexts[i], pdf_categories[i], fuzzy_hits[i]
             )
-            
-            fuzzy_results.append({
-                "id": pdf_value.get('id'),
-                "value": pdf_value.get('value'),
-                "context": pdf_context,
-                "business_category": pdf_category,
-                "data_type": pdf_value.get('data_type'),
-                "fuzzy_matches": matches
-            })
+            for i in range(len(pdf_batch))
+        ])
+        
+        # Results line up with pdf_batch; only the id is carried, callers already hold the PDF value
+        return [
+            {"id": pdf_value.get('id'), "fuzzy_matches": matches}
+            for pdf_value, matches in zip(pdf_batch, all_matches)
+        ]
+    
+    def _get_fuzzy_hits(self, pdf_procs: List[str]) -> List[Dict[int, float]]:
+        """
+        Fuzzy hits (excel index -> 0-1 similarity above the threshold) per processed PDF string.
+        Results are memoized per string; only cache misses are scored.
+        """
+        # The lock only guards the cache; scoring runs unlocked so concurrent batches score in parallel
+        # (cdist releases the GIL). Two batches missing the same string both score it, harmlessly.
+        with self._fuzzy_cache_lock:
+            found = {p: self._fuzzy_cache[p] for p in dict.fromkeys(pdf_procs) if p in self._fuzzy_cache}
+        misses = [p for p in dict.fromkeys(pdf_procs) if p not in found]
+        
+        for pdf_proc in misses:
+            found[pdf_proc] = self._score_fuzzy_hits(pdf_proc)
         
-        return fuzzy_results
+        with self._fuzzy_cache_lock:
+            for pdf_proc, hits in found.items():
+                self._fuzzy_cache[pdf_proc] = hits
+                self._fuzzy_cache.move_to_end(pdf_proc)
+            while len(self._fuzzy_cache) > FUZZY_CACHE_SIZE:
+                self._fuzzy_cache.popitem(last=False)
+        
+        return [found[pdf_proc] for pdf_proc in pdf_procs]
+    
+    def _score_fuzzy_hits(self, pdf_proc: str) -> Dict[int, float]:
+        """Score one processed PDF string against every Excel value that could reach the cutoff"""
+        cutoff = self.similarity_threshold
+        # Normalized Levenshtein similarity is bounded by min(len)/max(len);
+        # skip rows that can't reach the cutoff
+        pdf_len = len(pdf_proc)
+        bound = np.minimum(pdf_len, self._excel_lens) / np.maximum(np.maximum(pdf_len, self._excel_lens), 1)
+        candidates = np.nonzero(bound >= cutoff)[0]
+        
+        # q-gram lemma: within k edits, strings share >= max_len - 3 + 1 - 3k trigrams.
+        # Where that is >= 1, a row whose trigram bloom shares no bit with ours can't match.
+        if len(candidates):
+            max_len = np.maximum(pdf_len, self._excel_lens[candidates])
+            max_edits = np.floor((1 - cutoff) * max_len + 1e-9)
+            needs_shared = (max_len - 2 - 3 * max_edits) >= 1
+            pdf_bloom = np.uint64(_trigram_bloom(pdf_proc))
+            no_shared = np.bitwise_and(self._excel_bloom[candidates], pdf_bloom) == 0
+            candidates = candidates[~(needs_shared & no_shared)]
+        
+        if not len(candidates):
+            return {}
+        scores = process.cdist(
+            [pdf_proc],
+            self._excel_proc[candidates].tolist(),
+            # Bit-parallel (Myers/Hyyro) Levenshtein: a single 64-bit word for strings up to 64 chars
+            scorer=Levenshtein.normalized_similarity,
+            processor=None,
+            score_cutoff=cutoff,
+            dtype=np.float32
+        )[0]
+        hit_pos = np.nonzero(scores)[0]
+        return dict(zip(candidates[hit_pos].tolist(), scores[hit_pos].tolist()))
     
-    async def _find_fuzzy_matches(self, pdf_value: str, pdf_context: str, pdf_category: str) -> List[Dict]:
-        """Find fuzzy matches for a single PDF value"""
+    def _find_fuzzy_matches(self, pdf_value: str, pdf_context: str, pdf_category: str,
+                            fuzzy_hits: Dict[int, float]) -> List[Dict]:
+        """
+        Find fuzzy matches for a single PDF value.
+        fuzzy_hits maps Excel row index -> precomputed 0-1 similarity for rows above the threshold.
+        """
         matches = []
         
         try:
-            # Direct value matching
-            for excel_item in self.excel_data:
-                excel_val = str(excel_item.get('value', ''))
-                
-                # Skip empty values
-                if not excel_val or not pdf_value:
-                    continue
-                
-                # Try exact match first
-                if self._is_exact_match(pdf_value, excel_val):
-                    matches.append({
-                        "excel_value": excel_val,
-                        "excel_location": excel_item.get('cell_address'),
-                        "excel_context": excel_item.get('full_context'),
-                        "confidence": 1.0,
-                        "match_type": "exact_value",
-                        "business_context": excel_item.get('table_title'),
-                        "matching_algorithm": "exact"
-                    })
-                    continue
+            # Normalize the PDF side once; the Excel side is precomputed in load_excel_data
+            pdf_norm = self._normalize_exact(pdf_value)
+            pdf_num = self._parse_numeric(pdf_value)
+            
+            # Direct value matching; each Excel row matches at most once: exact > numeric > fuzzy
+            if pdf_value:
+                row_matches = {}
+                for j in self._exact_index.get(pdf_norm, ()):
+                    row_matches[j] = (1.0, "exact_value", "exact")
                 
-                # Try numeric matching for numerical values
-                if self._is_numeric_match(pdf_value, excel_val):
-                    matches.append({
-                        "excel_value": excel_val,
-                        "excel_location": excel_item.get('cell_address'),
-                        "excel_context": excel_item.get('full_context'),
-                        "confidence": 0.95,
-                        "match_type": "numeric",
-                        "business_context": excel_item.get('table_title'),
-                        "matching_algorithm": "numeric"
-                    })
-                    continue
+                for j in np.nonzero(self._numeric_match_mask(pdf_num))[0].tolist():
+                    row_matches.setdefault(j, (0.95, "numeric", "numeric"))
                 
-                # Try fuzzy string matching
-                similarity = fuzz.ratio(str(pdf_value).lower(), str(excel_val).lower()) / 100.0
+                # Fuzzy string similarity from the cached hits
+                for j, similarity in fuzzy_hits.items():
+                    if similarity >= self.similarity_threshold:
+                        row_matches.setdefault(j, (similarity, "fuzzy_value", "fuzzy_string"))
                 
-                if similarity >= self.similarity_threshold:
+                # Emit in Excel row order, as the old full scan did
+                for j in sorted(row_matches):
+                    confidence, match_type, algorithm = row_matches[j]
+                    excel_item = self.excel_data[j]
                     matches.append({
-                        "excel_value": excel_val,
+                        "excel_value": self._excel_strs[j],
                         "excel_location": excel_item.get('cell_address'),
+                        "excel_sheet": excel_item.get('sheet_name'),
                         "excel_context": excel_item.get('full_context'),
-                        "confidence": similarity,
-                        "match_type": "fuzzy_value",
+                        "confidence": confidence,
+                        "match_type": match_type,
                         "business_context": excel_item.get('table_title'),
-                        "matching_algorithm": "fuzzy_string"
+                        "matching_algorithm": algorithm
                     })
             
             # Context-based matching if no direct matches found
             if not matches and pdf_context:
-                matches.extend(await self._context_based_matching(pdf_value, pdf_context, pdf_category))
+                matches.extend(self._context_based_matching(pdf_value, pdf_context, pdf_category))
             
-            # Sort by confidence and return top 5 matches
-            matches.sort(key=lambda x: x['confidence'], reverse=True)
-            return matches[:5]
+            # Return top 5 matches by confidence
+            return heapq.nlargest(5, matches, key=lambda x: x['confidence'])
             
         except Exception as e:
             logger.error(f"Fuzzy matching error for value '{pdf_value}': {e}")
             return []
     
-    def _is_exact_match(self, pdf_value: str, excel_value: str) -> bool:
-        """Check for exact match with normalization"""
+    @staticmethod
+    def _normalize_exact(value: str) -> str:
+        """Normalized form used for exact matching (case, commas and spaces ignored)"""
+        return str(value).strip().lower().translate(_EXACT_STRIP_TABLE)
+    
+    @staticmethod
+    def _to_decimal(value: str) -> Optional[Decimal]:
+        """
+        Exact decimal value of a plain displayed number (commas and spaces ignored).
+        None for anything else, including "125%", "$125" and "(125)", so those never settle locally.
+        """
+        text = str(value).translate(_DECIMAL_STRIP_TABLE)
+        if not text:
+            return None
         try:
-            pdf_clean = str(pdf_value).strip().lower()
-            excel_clean = str(excel_value).strip().lower()
-            
-            # Remove common formatting differences
-            pdf_clean = pdf_clean.replace(',', '').replace(' ', '')
-            excel_clean = excel_clean.replace(',', '').replace(' ', '')
-            
-            return pdf_clean == excel_clean
-        except:
+            number = Decimal(text)
+        except InvalidOperation:
+            return None
+        return number if number.is_finite() else None
+    
+    def find_unique_exact_match(self, pdf_value: str) -> Optional[Dict]:
+        """
+        The Excel record holding exactly this numeric value, when it is the only one in the workbook
+        and the value has enough digits that a coincidental match is unlikely. None otherwise.
+        """
+        key = self._to_decimal(pdf_value)
+        if key is None or not self._has_min_digits(key):
+            return None
+        rows = self._decimal_index.get(key, ())
+        return self.excel_data[rows[0]] if len(rows) == 1 else None
+    
+    @staticmethod
+    def _has_min_digits(number: Decimal) -> bool:
+        """Whether a number has enough significant digits (LOCAL_MATCH_MIN_DIGITS) to trust a match without review"""
+        return sum(ch.isdigit() for ch in str(number).lstrip('-0.')) >= LOCAL_MATCH_MIN_DIGITS
+    
+    def is_trusted_exact_match(self, pdf_value: str, excel_value: str) -> bool:
+        """
+        Whether a PDF and Excel value are the same number as displayed, signs, brackets and '%' included,
+        with enough digits that a coincidental match is unlikely
+        """
+        pdf_norm = self._normalize_exact(pdf_value)
+        if pdf_norm != self._normalize_exact(excel_value):
             return False
+        number = self._to_decimal(pdf_norm)
+        return number is not None and self._has_min_digits(number)
     
-    def _is_numeric_match(self, pdf_value: str, excel_value: str) -> bool:
-        """Check for numeric equivalence with tolerance"""
+    @staticmethod
+    def _parse_numeric(value: str) -> float:
+        """Parse a displayed number ignoring commas and '%'; NaN when not numeric"""
         try:
-            # Try to convert to numbers
-            pdf_num = float(str(pdf_value).replace(',', '').replace('%', '').strip())
-            excel_num = float(str(excel_value).replace(',', '').replace('%', '').strip())
-            
-            # Check if they're within 1% of each other
-            if pdf_num == 0 and excel_num == 0:
-                return True
-            elif pdf_num == 0 or excel_num == 0:
-                return False
-            
-            difference = abs(pdf_num - excel_num) / max(abs(pdf_num), abs(excel_num))
-            return difference <= 0.01  # 1% tolerance
-            
+            return float(str(value).translate(_NUMERIC_STRIP_TABLE).strip())
         except (ValueError, TypeError):
-            return False
+            return float('nan')
+    
+    @staticmethod
+    def _parse_numeric_column(values: List[str]) -> np.ndarray:
+        """Vectorized _parse_numeric over a whole column (NaN where not numeric)"""
+        cleaned = pd.Series([v.translate(_NUMERIC_STRIP_TABLE).strip() for v in values], dtype=object)
+        return pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
     
-    async def _context_based_matching(self, pdf_value: str, pdf_context: str, pdf_category: str) -> List[Dict]:
+    def _numeric_match_mask(self, pdf_num: float) -> np.ndarray:
+        """Boolean mask of Excel rows numerically equivalent to pdf_num (within 1%)"""
+        excel_num = self._excel_num
+        if math.isnan(pdf_num):
+            return np.zeros(len(excel_num), dtype=bool)
+        
+        # Both zero counts as a match; exactly one zero never does
+        if pdf_num == 0:
+            return excel_num == 0
+        
+        # NaN rows compare False throughout
+        with np.errstate(invalid='ignore'):
+            denom = np.maximum(abs(pdf_num), np.abs(excel_num))
+            return (excel_num != 0) & (np.abs(excel_num - pdf_num) <= 0.01 * denom)
+    
+    def _context_based_matching(self, pdf_value: str, pdf_context: str, pdf_category: str) -> List[Dict]:
         """Perform context-based matching when direct value matching fails"""
         context_matches = []
         
         try:
-            for excel_item in self.excel_data:
-                excel_context = excel_item.get('full_context', '') + ' ' + excel_item.get('table_title', '')
-                
-                # Calculate context similarity
-                context_similarity = fuzz.partial_ratio(
-                    str(pdf_context).lower(), 
-                    str(excel_context).lower()
-                ) / 100.0
+            pdf_context_proc = utils.default_process(str(pdf_context))
+            
+            # Only score rows that share tokens with the PDF context
+            candidates = self._context_candidates(pdf_context_proc)
+            if not len(candidates):
+                return context_matches
+            
+            # Calculate context similarity against the precomputed Excel contexts in one call
+            scores = process.cdist(
+                [pdf_context_proc],
+                self._excel_contexts[candidates].tolist(),
+                scorer=fuzz.partial_ratio,
+                processor=None,
+                score_cutoff=70,
+                dtype=np.float32
+            )[0]
+            
+            for j, score in zip(candidates.tolist(), scores.tolist()):
+                context_similarity = score / 100.0
                 
                 if context_similarity >= 0.7:  # Context similarity threshold
+                    excel_item = self.excel_data[j]
                     context_matches.append({
                         "excel_value": excel_item.get('value'),
                         "excel_location": excel_item.get('cell_address'),
+                        "excel_sheet": excel_item.get('sheet_name'),
                         "excel_context": excel_item.get('full_context'),
                         "confidence": context_similarity * 0.8,  # Weight context matches lower
                         "match_type": "context_based",
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import structlog
+from decouple import config
+
+# Configure logging
+logger = structlog.get_logger()
+
+GEMINI_CACHE_PATH = config('GEMINI_CACHE_PATH', default='cache/gemini_responses.sqlite3')
+GEMINI_CACHE_TTL_SECONDS = config('GEMINI_CACHE_TTL_SECONDS', default=7 * 24 * 3600, cast=int)
+GEMINI_CACHE_ENABLED = config('GEMINI_CACHE_ENABLED', default=True, cast=bool)
+
+
+class GeminiCache:
+    """Persistent Gemini response cache keyed by a SHA-256 of the request contents"""
+
+    def __init__(self, path: str = GEMINI_CACHE_PATH, ttl_seconds: int = GEMINI_CACHE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.dedup_hits = 0
+        self._lock = threading.Lock()
+        # Requests currently waiting on the API, so identical concurrent requests share one call
+        self._pending: Dict[str, asyncio.Task] = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, doc_id TEXT, response_text TEXT NOT NULL, cached_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_doc_id ON responses (doc_id)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Hash prompt text, model names and raw image/table bytes into one cache key"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, (bytes, bytearray, memoryview)) else str(part).encode('utf-8'))
+            digest.update(b'\0')  # separator so ("ab", "c") and ("a", "bc") differ
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response text, or None when missing or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response_text, cached_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key: str, response_text: str, doc_id: Optional[str] = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, doc_id, response_text, cached_at) VALUES (?, ?, ?, ?)",
+                (key, doc_id, response_text, time.time())
+            )
+            self._conn.commit()
+
+    def invalidate(self, key: str):
+        """Drop one cached response, e.g. one that turned out to be unparseable"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def invalidate_doc(self, doc_id: str) -> int:
+        """Drop every cached response recorded for a document; returns the number removed"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM responses WHERE doc_id = ?", (doc_id,))
+            self._conn.commit()
+        logger.info(f"Invalidated {cursor.rowcount} cached Gemini responses for {doc_id}")
+        return cursor.rowcount
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[Any]],
+                              doc_id: Optional[str] = None) -> str:
+        """Return cached response text for key, calling Gemini and storing the text on a miss"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        task = self._pending.get(key)
+        if task is not None:
+            self.dedup_hits += 1
+        else:
+            # The call runs as its own task, so cancelling the caller that started it
+            # (e.g. a disconnected client) does not cancel it for the others waiting on it
+            task = asyncio.ensure_future(self._generate_and_store(key, generate, doc_id))
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._call_finished(key, done))
+        # shield: a cancelled caller only stops waiting, the shared call carries on
+        return await asyncio.shield(task)
+
+    async def _generate_and_store(self, key: str, generate: Callable[[], Awaitable[Any]],
+                                  doc_id: Optional[str]) -> str:
+        response = await generate()
+        response_text = response.text
+        self.put(key, response_text, doc_id)
+        return response_text
+
+    def _call_finished(self, key: str, task: asyncio.Task):
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved so a failure nobody awaited any more is not logged as lost
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "dedup_hits": self.dedup_hits}
+
+
+class _DisabledGeminiCache(GeminiCache):
+    """Used when GEMINI_CACHE_ENABLED is off: nothing is stored, only in-flight requests are shared"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.dedup_hits = 0
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def get(self, key: str) -> Optional[str]:
+        return None
+
+    def put(self, key: str, response_text: str, doc_id: Optional[str] = None):
+        pass
+
+    def invalidate(self, key: str):
+        pass
+
+    def invalidate_doc(self, doc_id: str) -> int:
+        return 0
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_gemini_cache():
+    """Process-wide Gemini response cache, opened on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GeminiCache() if GEMINI_CACHE_ENABLED else _DisabledGeminiCache()
+        return _cache
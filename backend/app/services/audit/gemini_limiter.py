@@ -0,0 +1,151 @@
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Iterable, Optional, Tuple
+
+import structlog
+from decouple import config
+from google.api_core.exceptions import ResourceExhausted
+
+# Configure logging
+logger = structlog.get_logger()
+
+GEMINI_RPM = config('GEMINI_RPM', default=60, cast=int)
+GEMINI_TPM = config('GEMINI_TPM', default=100_000, cast=int)
+GEMINI_MAX_CONCURRENCY = config('GEMINI_MAX_CONCURRENCY', default=8, cast=int)
+# Calls slower than this stop the concurrency window from growing (vision calls routinely take several seconds)
+GEMINI_TARGET_LATENCY_SECONDS = config('GEMINI_TARGET_LATENCY_SECONDS', default=20.0, cast=float)
+GEMINI_MAX_RETRIES = 4
+GEMINI_RETRY_BASE_DELAY = 2.0
+
+# AIMD parameters: grow the window by ALPHA per window of successes, scale it by BETA on a 429
+AIMD_ALPHA = 1.0
+AIMD_BETA = 0.5
+
+# Gemini bills small images as one 258-token tile and larger ones per 768x768 tile
+IMAGE_TILE_TOKENS = 258
+IMAGE_TILE_PX = 768
+IMAGE_SMALL_PX = 384
+
+
+def estimate_tokens(text: str = "", image_sizes: Iterable[Tuple[int, int]] = ()) -> int:
+    """Rough input-token estimate for a request: ~4 characters per text token plus image tiles"""
+    tokens = len(text) // 4
+    for width, height in image_sizes:
+        if width <= IMAGE_SMALL_PX and height <= IMAGE_SMALL_PX:
+            tokens += IMAGE_TILE_TOKENS
+        else:
+            tokens += math.ceil(width / IMAGE_TILE_PX) * math.ceil(height / IMAGE_TILE_PX) * IMAGE_TILE_TOKENS
+    return tokens
+
+
+class GeminiLimiter:
+    """
+    Adaptive client-side limiter for Gemini calls.
+    Keeps sliding one-minute windows for requests and tokens under the RPM/TPM quota,
+    and an AIMD concurrency window: additive increase while calls succeed within the
+    target latency, multiplicative decrease when the API answers 429.
+    """
+
+    def __init__(self, rpm: int = GEMINI_RPM, tpm: int = GEMINI_TPM,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY,
+                 target_latency: float = GEMINI_TARGET_LATENCY_SECONDS):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max(1, max_concurrency)
+        self.target_latency = target_latency
+        self._limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._requests = deque()  # start times within the last minute
+        self._tokens = deque()    # (start time, estimated tokens) within the last minute
+        self._tokens_in_window = 0
+        self._changed = asyncio.Event()
+
+    @property
+    def concurrency_limit(self) -> int:
+        return max(1, int(self._limit))
+
+    def _trim(self, now: float):
+        horizon = now - 60.0
+        while self._requests and self._requests[0] <= horizon:
+            self._requests.popleft()
+        while self._tokens and self._tokens[0][0] <= horizon:
+            self._tokens_in_window -= self._tokens.popleft()[1]
+
+    def _wait_time(self, now: float, estimated_tokens: int) -> Optional[float]:
+        """0 when a request may start now, seconds until a window frees up, or None to wait for a release"""
+        if self._in_flight >= self.concurrency_limit:
+            return None
+        wait = 0.0
+        if len(self._requests) >= self.rpm:
+            wait = max(wait, self._requests[0] + 60.0 - now)
+        # A single request larger than the whole budget is let through once the window is empty
+        if self._tokens and self._tokens_in_window + estimated_tokens > self.tpm:
+            wait = max(wait, self._tokens[0][0] + 60.0 - now)
+        return wait
+
+    def _notify(self):
+        # Wake every waiter; each re-checks the windows and sleeps again if still blocked
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def acquire(self, estimated_tokens: int = 0):
+        while True:
+            now = time.monotonic()
+            self._trim(now)
+            wait = self._wait_time(now, estimated_tokens)
+            if wait is not None and wait <= 0:
+                self._in_flight += 1
+                self._requests.append(now)
+                self._tokens.append((now, estimated_tokens))
+                self._tokens_in_window += estimated_tokens
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, latency: float, throttled: bool = False):
+        self._in_flight -= 1
+        if throttled:
+            self._limit = max(1.0, self._limit * AIMD_BETA)
+            logger.warning(f"Gemini throttled; concurrency window reduced to {self.concurrency_limit}")
+        elif latency <= self.target_latency:
+            # +ALPHA per full window of successful calls
+            self._limit = min(float(self.max_concurrency), self._limit + AIMD_ALPHA / self._limit)
+        self._notify()
+
+    async def call(self, generate: Callable[[], Awaitable[Any]], estimated_tokens: int = 0,
+                   context: str = "gemini") -> Any:
+        """Run one Gemini call inside the limiter, backing off with jitter and retrying on 429"""
+        for attempt in range(GEMINI_MAX_RETRIES):
+            await self.acquire(estimated_tokens)
+            started = time.monotonic()
+            throttled = False
+            try:
+                return await generate()
+            except ResourceExhausted as e:
+                throttled = True
+                if attempt == GEMINI_MAX_RETRIES - 1:
+                    raise
+                delay = GEMINI_RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logger.warning(f"Gemini quota exhausted for {context} ({e}), retrying in {delay:.1f}s")
+            finally:
+                self.release(time.monotonic() - started, throttled)
+            await asyncio.sleep(delay)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_gemini_limiter() -> GeminiLimiter:
+    """Process-wide limiter, so every service shares one view of the API quota"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = GeminiLimiter()
+        return _limiter
@@ -7,17 +7,127 @@ from PIL import Image
 import io
 import time
 import asyncio
+import hashlib
+import threading
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
 import pandas as pd
 from decouple import config
 import re
 from datetime import datetime
 import math
+import numpy as np
+import orjson
+from app.services.audit.gemini_cache import get_gemini_cache
+from app.services.audit.gemini_limiter import estimate_tokens, get_gemini_limiter
 
 # Configure logging
 logger = structlog.get_logger()
 
+# Shared JSON decoder and precompiled "<key>": [ patterns for response recovery
+_DECODER = json.JSONDecoder()
+_RECOVERY_KEYS = ("extracted_values", "potential_sources", "batch_analysis")
+_KEY_PATTERNS = {key: re.compile(rf'"{key}"\s*:\s*\[') for key in _RECOVERY_KEYS}
+
+# Page images are sent as JPEG; the SDK would otherwise re-encode PIL images as lossless WebP
+PAGE_JPEG_QUALITY = config('PDF_PAGE_JPEG_QUALITY', default=85, cast=int)
+# Render scale is capped so the long side stays near what Gemini keeps after downsampling
+PAGE_MAX_SCALE = 2.0
+PAGE_MAX_LONG_SIDE_PX = config('PDF_PAGE_MAX_LONG_SIDE_PX', default=1600, cast=int)
+# Pages sent together in one Gemini request (1 disables batching)
+PAGES_PER_REQUEST = max(1, config('PDF_PAGES_PER_REQUEST', default=4, cast=int))
+# Documents with at least this many pages are rendered in a process pool instead of one locked thread
+RENDER_PROCESS_MIN_PAGES = config('PDF_RENDER_PROCESS_MIN_PAGES', default=8, cast=int)
+
+# Static page-extraction instructions. They are sent as the system instruction so every
+# page request starts with an identical prefix that Gemini's context cache can reuse.
+_PAGE_EXTRACTION_INSTRUCTION = """
+Analyze the given presentation slide and extract ONLY meaningful business-related numerical data.
+Focus strictly on quantitative or financial metrics that convey insight — such as revenues, profits, growth %, market share, and performance indicators.
+
+❌ HARD DO NOT EXTRACT:
+- Section numbers, slide numbers, or page numbers (e.g., "1", "2", "Page 3")
+- Bullet or list numbers
+- Decorative numbers or formatting numbers (asterisks, superscripts, footnotes)
+- Standalone fiscal years or quarters (e.g., "FY26", "Q1 FY26") unless directly tied to a numeric metric (e.g., "Revenue grew 40% in FY26")
+- Any number that exists purely as a reference, label, or metadata
+
+✅ ONLY EXTRACT:
+- Financial, market, or operational metrics with clear business meaning
+- Percentages, ratios, and growth figures
+- Quantitative data directly tied to tables, charts, or performance indicators
+- Dates or periods only if they are attached to a numeric metric (e.g., "Revenue in Q1 FY26: $10M")
+
+For each number, provide:
+- Exact value as displayed
+- Business context
+- Normalized coordinates [x1, y1, x2, y2] on 0–1 scale
+- Data type classification
+- Only include data points that provide measurable business insight
+
+The page number and page image size are given with each slide. Use them for
+<page_number>, <width> and <height> below.
+
+Return ONLY valid JSON in this exact format:
+{
+    "page_number": <page_number>,
+    "page_dimensions": {"width": <width>, "height": <height>},
+    "extracted_values": [
+        {
+            "id": "value_<page_number>_001",
+            "value": "exact_number_as_displayed",
+            "normalized_value": "cleaned_numeric_format",
+            "data_type": "currency|percentage|count|ratio|date|metric",
+            "business_context": {
+                "semantic_meaning": "detailed_description_of_what_this_number_represents",
+                "business_category": "revenue|costs|growth|operational|financial|market",
+                "presentation_priority": "primary|secondary|supporting",
+                "calculation_type": "absolute|percentage|ratio|growth_rate|other"
+            },
+            "confidence": 0.9
+        }
+    ]
+}
+If the only number on a page appears isolated (e.g., "1" or "2" in a corner or footer)
+with context related to page number or slide number, ignore that
+and return a blank json {}
+"""
+
+def _rasterize_page(page) -> Tuple[bytes, Tuple[int, int], int]:
+    """Render a page to raw RGB samples no larger than the pixel budget"""
+    # Coordinates are normalized, so the render scale does not affect them
+    scale = min(PAGE_MAX_SCALE, PAGE_MAX_LONG_SIDE_PX / max(page.rect.width, page.rect.height, 1))
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+    return pix.samples, (pix.width, pix.height), pix.stride
+
+
+def _encode_page(samples: bytes, image_size: Tuple[int, int], stride: int) -> Tuple[bytes, Tuple[int, int], str]:
+    """Encode raw RGB samples as JPEG; returns the JPEG bytes, the image size and a digest of the pixels"""
+    image = Image.frombuffer("RGB", image_size, samples, "raw", "RGB", stride, 1)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=PAGE_JPEG_QUALITY)
+    image.close()
+    return buffer.getvalue(), image_size, hashlib.sha256(samples).hexdigest()
+
+
+# The one document a render worker process has open, as (path, document), reused across its pages
+_worker_doc: Optional[Tuple[str, Any]] = None
+
+
+def _render_pdf_page(pdf_path: str, page_index: int) -> Tuple[bytes, Tuple[int, int], str]:
+    """Render and encode one page inside a worker process"""
+    global _worker_doc
+    if _worker_doc is None or _worker_doc[0] != pdf_path:
+        # A worker keeps at most one document open; a new path closes the previous one
+        if _worker_doc is not None:
+            _worker_doc[1].close()
+            _worker_doc = None
+        _worker_doc = (pdf_path, fitz.open(pdf_path, filetype='pdf'))
+    return _encode_page(*_rasterize_page(_worker_doc[1][page_index]))
+
+
 class PdfAnalysisService:
     def __init__(self):
         # Get API key from environment
@@ -29,7 +139,18 @@ class PdfAnalysisService:
         genai.configure(api_key=api_key)
         # self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
         self.model = genai.GenerativeModel('gemini-2.5-flash-lite')
+        # Page extraction model carries the static prompt as a cacheable system instruction
+        self.page_model = genai.GenerativeModel('gemini-2.5-flash-lite', system_instruction=_PAGE_EXTRACTION_INSTRUCTION)
         self.ai_enabled = True
+        # Bound page batches in flight (and so rendered images held in memory); the limiter paces the API
+        self._page_semaphore = asyncio.Semaphore(config('PDF_PAGE_CONCURRENCY', default=8, cast=int))
+        self._render_lock = threading.Lock()
+        # Set for the duration of an extraction when pages render in worker processes
+        self._render_pool = None
+        self._render_path = None
+        # Shared RPM/TPM windows and AIMD concurrency control for all Gemini calls
+        self._limiter = get_gemini_limiter()
+        self._response_cache = get_gemini_cache()
 
         logger.info("Enhanced Gemini 2.5 Pro PDF Service initialized with comprehensive extraction settings")
 
@@ -41,101 +162,117 @@ class PdfAnalysisService:
         logger.info(f"Starting comprehensive PDF extraction: {pdf_path}")
         
         try:
-            doc = fitz.open(pdf_path)
-            page_analyses = []
+            doc = fitz.open(pdf_path, filetype='pdf')
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                
-                # Extract high-quality page image with coordinates
-                page_data = await self._extract_page_with_coordinates(page, page_num + 1)
-                if len(page_data['extracted_values']) == 0:
-                    continue
-                page_analyses.append(page_data)
-                
-                # Rate limiting for Gemini API
-                # await asyncio.sleep(1)
+            # Rendering is CPU-bound and PyMuPDF is single-threaded per document, so
+            # large decks render in worker processes that each open the file themselves
+            if doc.page_count >= RENDER_PROCESS_MIN_PAGES:
+                # spawn, not fork: forking this multi-threaded server can copy a lock some other thread holds
+                self._render_pool = ProcessPoolExecutor(
+                    max_workers=min(os.cpu_count() or 1, doc.page_count),
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                self._render_path = pdf_path
             
-            doc.close()
+            try:
+                # Pages go to Gemini a few per request; the requests are network-bound, so run them concurrently
+                # Batches are page index ranges; each loads its pages only once it holds a concurrency slot
+                batches = [
+                    range(start, min(start + PAGES_PER_REQUEST, doc.page_count))
+                    for start in range(0, doc.page_count, PAGES_PER_REQUEST)
+                ]
+                results = await asyncio.gather(*[self._extract_batch_bounded(doc, batch, pdf_path) for batch in batches])
+                page_analyses = [
+                    page_data for batch_results in results for page_data in batch_results
+                    if len(page_data['extracted_values']) > 0
+                ]
+            finally:
+                if self._render_pool is not None:
+                    self._render_pool.shutdown()
+                    self._render_pool = None
+                doc.close()
             
             # Synthesize complete document analysis
             comprehensive_data = await self._synthesize_document_analysis(page_analyses)
             
             logger.info(f"PDF extraction completed: {len(comprehensive_data.get('all_extracted_values', []))} values found")
+            logger.info(f"Gemini response cache: {self._response_cache.stats()}")
             return comprehensive_data
             
         except Exception as e:
             logger.error(f"PDF extraction failed: {e}")
             raise
           
-    async def _extract_page_with_coordinates(self, page, page_num: int) -> Dict[str, Any]:
+    async def _extract_batch_bounded(self, doc, page_indices: range, doc_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Load and extract a batch of pages while holding a slot of the page concurrency semaphore"""
+        async with self._page_semaphore:
+            pages = await asyncio.to_thread(self._load_pages, doc, page_indices)
+            if len(pages) == 1:
+                page_num, page = pages[0]
+                return [await self._extract_page_with_coordinates(page, page_num, doc_id)]
+            return await self._extract_pages_batch(pages, doc_id)
+
+    async def _generate_with_retry(self, model, contents, context: str, image_sizes: List[Tuple[int, int]]):
+        """Page-model Gemini call through the shared limiter, which retries on 429 responses"""
+        prompt_text = _PAGE_EXTRACTION_INSTRUCTION + "".join(part for part in contents if isinstance(part, str))
+        return await self._limiter.call(
+            # Native async SDK call, so in-flight pages overlap on the event loop
+            lambda: model.generate_content_async(contents),
+            estimated_tokens=estimate_tokens(prompt_text, image_sizes),
+            context=context
+        )
+
+    def _load_pages(self, doc, page_indices: range) -> List[Tuple[int, Any]]:
+        """(page number, page) pairs for the given 0-based indices (runs in a worker thread)"""
+        # Loading touches the document, so it shares the render lock
+        with self._render_lock:
+            return [(i + 1, doc.load_page(i)) for i in page_indices]
+
+    def _render_page(self, page) -> Tuple[bytes, Tuple[int, int], str]:
+        """
+        Render a page and encode it as JPEG (runs in a worker thread).
+        Returns the JPEG bytes, the image size and a digest of the raw pixels.
+        """
+        # PyMuPDF is not thread-safe, so renders of the shared document are serialized
+        with self._render_lock:
+            rendered = _rasterize_page(page)
+        
+        # Encoding does not touch the document, so it runs outside the render lock
+        return _encode_page(*rendered)
+
+    async def _render(self, page, page_num: int) -> Tuple[bytes, Tuple[int, int], str]:
+        """Render a page off the event loop, in the process pool when one is active"""
+        if self._render_pool is not None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._render_pool, _render_pdf_page, self._render_path, page_num - 1)
+        return await asyncio.to_thread(self._render_page, page)
+
+    async def _extract_page_with_coordinates(self, page, page_num: int, doc_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Extract page data with precise coordinate mapping using Gemini 2.5 Pro
         """
         try:
-            # Convert page to high-resolution image
-            mat = fitz.Matrix(2.0, 2.0)  # High quality for better extraction
-            pix = page.get_pixmap(matrix=mat)
-            img_data = pix.tobytes("png")
+            # Render off the event loop so it overlaps with other pages' Gemini calls
+            jpeg_bytes, image_size, image_digest = await self._render(page, page_num)
+            image_part = {"mime_type": "image/jpeg", "data": jpeg_bytes}
             
-            # Convert to PIL Image for Gemini
-            image = Image.open(io.BytesIO(img_data))
+            # Only the per-page part is sent; the static instructions live in the system instruction
+            prompt = f"Analyze this presentation slide (page {page_num}). The page image is {image_size[0]}x{image_size[1]} pixels."
             
-            # Enhanced prompt for better extraction
-            prompt = f"""
-            Analyze this presentation slide (page {page_num}) and extract ONLY meaningful business-related numerical data. 
-            Focus strictly on quantitative or financial metrics that convey insight — such as revenues, profits, growth %, market share, and performance indicators.
-
-            ❌ HARD DO NOT EXTRACT:
-            - Section numbers, slide numbers, or page numbers (e.g., "1", "2", "Page 3")
-            - Bullet or list numbers
-            - Decorative numbers or formatting numbers (asterisks, superscripts, footnotes)
-            - Standalone fiscal years or quarters (e.g., "FY26", "Q1 FY26") unless directly tied to a numeric metric (e.g., "Revenue grew 40% in FY26")
-            - Any number that exists purely as a reference, label, or metadata
-
-            ✅ ONLY EXTRACT:
-            - Financial, market, or operational metrics with clear business meaning
-            - Percentages, ratios, and growth figures
-            - Quantitative data directly tied to tables, charts, or performance indicators
-            - Dates or periods only if they are attached to a numeric metric (e.g., "Revenue in Q1 FY26: $10M")
-
-            For each number, provide:
-            - Exact value as displayed
-            - Business context
-            - Normalized coordinates [x1, y1, x2, y2] on 0–1 scale
-            - Data type classification
-            - Only include data points that provide measurable business insight
-
-            Return ONLY valid JSON in this exact format:
-            {{
-                "page_number": {page_num},
-                "page_dimensions": {{"width": {image.width}, "height": {image.height}}},
-                "extracted_values": [
-                    {{
-                        "id": "value_{page_num}_001",
-                        "value": "exact_number_as_displayed",
-                        "normalized_value": "cleaned_numeric_format",
-                        "data_type": "currency|percentage|count|ratio|date|metric",
-                        "business_context": {{
-                            "semantic_meaning": "detailed_description_of_what_this_number_represents",
-                            "business_category": "revenue|costs|growth|operational|financial|market",
-                            "presentation_priority": "primary|secondary|supporting",
-                            "calculation_type": "absolute|percentage|ratio|growth_rate|other"
-                        }},
-                        "confidence": 0.9
-                    }}
-                ]
-            }}
-            If the only number on a page appears isolated (e.g., "1" or "2" in a corner or footer) 
-            with context related to page number or slide number, ignore that
-            and return a blank json {{}}
-            """
-            
-            response = self.model.generate_content([prompt, image])
-            result = await self._parse_gemini_json_response_robust(response.text, f"page_{page_num}")
-            
-            # Validate and enhance coordinates
-            result = self._validate_and_enhance_coordinates(result, image.size)
+            # Identical page pixels under the same prompt give the same answer, so reuse it
+            cache_key = self._response_cache.make_key(
+                self.page_model.model_name, _PAGE_EXTRACTION_INSTRUCTION, prompt, image_digest
+            )
+            response_text = await self._response_cache.get_or_generate(
+                cache_key,
+                lambda: self._generate_with_retry(self.page_model, [prompt, image_part], f"page_{page_num}", [image_size]),
+                doc_id=doc_id
+            )
+            result = await self._parse_gemini_json_response_robust(response_text, f"page_{page_num}")
+            if result.pop("recovered", False) or result.get("error"):
+                # Don't replay a response we could not fully parse; a re-run asks Gemini again
+                self._response_cache.invalidate(cache_key)
+            result = self._finalize_page_result(result, page_num, image_size)
             
             logger.info(f"Page {page_num}: Extracted {len(result.get('extracted_values', []))} values")
             return result
@@ -149,42 +286,124 @@ class PdfAnalysisService:
                 "error": str(e)
             }
 
+    async def _extract_pages_batch(self, pages: List[Tuple[int, Any]], doc_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Extract several pages in a single Gemini request.
+        Pages missing from the response (or a failed request) fall back to one call per page.
+        """
+        page_nums = [page_num for page_num, _ in pages]
+        context = f"page_batch_{page_nums[0]}-{page_nums[-1]}"
+        by_page_num = {}
+        image_sizes = {}
+        cache_key = None
+        
+        try:
+            renders = await asyncio.gather(*[self._render(page, page_num) for page_num, page in pages])
+            
+            prompt = (
+                f"Analyze each of the following {len(pages)} presentation slides separately. "
+                'Return ONLY valid JSON of the form {"pages": [...]} with one object per slide, '
+                "each in the format above with its own page_number. Include every slide; use an empty "
+                "extracted_values list for slides with nothing to extract."
+            )
+            contents = [prompt]
+            labels = []
+            for page_num, (jpeg_bytes, image_size, _) in zip(page_nums, renders):
+                image_sizes[page_num] = image_size
+                labels.append(f"Page {page_num} ({image_size[0]}x{image_size[1]} pixels):")
+                contents.append(labels[-1])
+                contents.append({"mime_type": "image/jpeg", "data": jpeg_bytes})
+            
+            # The page labels carry the numbering the model echoes back; the images enter by pixel digest
+            cache_key = self._response_cache.make_key(
+                self.page_model.model_name, _PAGE_EXTRACTION_INSTRUCTION, prompt, *labels,
+                *(image_digest for _, _, image_digest in renders)
+            )
+            response_text = await self._response_cache.get_or_generate(
+                cache_key,
+                lambda: self._generate_with_retry(self.page_model, contents, context, list(image_sizes.values())),
+                doc_id=doc_id
+            )
+            result = await self._parse_gemini_json_response_robust(response_text, context)
+            
+            for page_result in result.get("pages", []):
+                if not isinstance(page_result, dict):
+                    continue
+                try:
+                    page_num = int(page_result.get("page_number"))
+                except (TypeError, ValueError):
+                    continue
+                if page_num in image_sizes:
+                    by_page_num[page_num] = page_result
+            
+            # Salvaged, page-less or partial answers make every missing page cost a retry; don't replay them
+            if result.get("error") or result.get("recovered") or len(by_page_num) < len(pages):
+                self._response_cache.invalidate(cache_key)
+        
+        except Exception as e:
+            logger.error(f"Batch extraction for {context} failed, falling back to single pages: {e}")
+        
+        page_results = []
+        for page_num, page in pages:
+            page_result = None
+            if page_num in by_page_num:
+                try:
+                    page_result = self._finalize_page_result(by_page_num.pop(page_num), page_num, image_sizes[page_num])
+                    logger.info(f"Page {page_num}: Extracted {len(page_result['extracted_values'])} values")
+                except Exception as e:
+                    # One malformed page in the batched answer only costs that page its own request
+                    logger.error(f"Page {page_num} in {context} could not be finalized, retrying it alone: {e}")
+                    self._response_cache.invalidate(cache_key)
+                    page_result = None
+            if page_result is None:
+                page_result = await self._extract_page_with_coordinates(page, page_num, doc_id)
+            page_results.append(page_result)
+        return page_results
+
+    def _finalize_page_result(self, result: Dict, page_num: int, image_size: Tuple[int, int]) -> Dict:
+        """Fill in page metadata and normalize coordinates for one page's parsed response"""
+        # A blank {} means the page had nothing worth extracting
+        result.setdefault("page_number", page_num)
+        result.setdefault("page_dimensions", {"width": image_size[0], "height": image_size[1]})
+        result.setdefault("extracted_values", [])
+        
+        # Validate and enhance coordinates
+        return self._validate_and_enhance_coordinates(result, image_size)
 
     def _validate_and_enhance_coordinates(self, result: Dict, image_size: Tuple[int, int]) -> Dict:
         """Validate and enhance coordinate data"""
         width, height = image_size
         
+        valid = []
         for value in result.get('extracted_values', []):
             if 'coordinates' in value and 'bounding_box' in value['coordinates']:
-                bbox = value['coordinates']['bounding_box']
-                
-                # Ensure coordinates are valid
-                if len(bbox) == 4:
-                    x1, y1, x2, y2 = bbox
-                    x1 = max(0, min(1, float(x1)))
-                    y1 = max(0, min(1, float(y1)))
-                    x2 = max(0, min(1, float(x2)))
-                    y2 = max(0, min(1, float(y2)))
-                    
-                    # Ensure logical ordering
-                    if x1 > x2:
-                        x1, x2 = x2, x1
-                    if y1 > y2:
-                        y1, y2 = y2, y1
-                    
-                    # Ensure minimum size
-                    if x2 - x1 < 0.01:
-                        x2 = min(1, x1 + 0.01)
-                    if y2 - y1 < 0.01:
-                        y2 = min(1, y1 + 0.01)
-                    
-                    value['coordinates']['bounding_box'] = [x1, y1, x2, y2]
-                    value['coordinates']['center_point'] = [(x1 + x2) / 2, (y1 + y2) / 2]
+                if len(value['coordinates']['bounding_box']) == 4:
+                    valid.append(value)
                 else:
                     # Set default coordinates if invalid
                     value['coordinates']['bounding_box'] = [0.1, 0.1, 0.2, 0.2]
                     value['coordinates']['center_point'] = [0.15, 0.15]
         
+        if not valid:
+            return result
+        
+        # Validate all boxes at once as an (N, 4) array of [x1, y1, x2, y2]
+        boxes = np.clip(np.array([v['coordinates']['bounding_box'] for v in valid], dtype=np.float64), 0, 1)
+        
+        # Ensure logical ordering
+        boxes[:, [0, 2]] = np.sort(boxes[:, [0, 2]], axis=1)
+        boxes[:, [1, 3]] = np.sort(boxes[:, [1, 3]], axis=1)
+        
+        # Ensure minimum size
+        boxes[:, 2:] = np.where(
+            boxes[:, 2:] - boxes[:, :2] < 0.01, np.minimum(1, boxes[:, :2] + 0.01), boxes[:, 2:]
+        )
+        
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        for value, bbox, center in zip(valid, boxes.tolist(), centers.tolist()):
+            value['coordinates']['bounding_box'] = bbox
+            value['coordinates']['center_point'] = center
+        
         return result
 
     async def _parse_gemini_json_response_robust(self, response_text: str, context: str) -> Dict[str, Any]:
@@ -203,32 +422,21 @@ class PdfAnalysisService:
             if cleaned_text.endswith("```"):
                 cleaned_text = cleaned_text[:-3]
             
-            # Step 2: Find JSON boundaries more carefully
-            json_start = -1
-            json_end = -1
-            brace_count = 0
-            
-            for i, char in enumerate(cleaned_text):
-                if char == '{':
-                    if json_start == -1:
-                        json_start = i
-                    brace_count += 1
-                elif char == '}':
-                    brace_count -= 1
-                    if brace_count == 0 and json_start != -1:
-                        json_end = i
-                        break
+            # Step 2: Fast path for the common case where the cleaned text is exactly one JSON object
+            try:
+                result = orjson.loads(cleaned_text)
+                if isinstance(result, dict):
+                    logger.info(f"Successfully parsed Gemini JSON for {context}")
+                    return result
+            except orjson.JSONDecodeError:
+                pass
             
-            if json_start == -1 or json_end == -1:
+            # Step 3: Parse the first JSON object; raw_decode finds its end in C and ignores trailing text
+            json_start = cleaned_text.find('{')
+            if json_start == -1:
                 raise ValueError(f"No complete JSON object found in response for {context}")
             
-            json_str = cleaned_text[json_start:json_end + 1]
-            
-            # Step 3: Advanced JSON cleaning
-            # json_str = self._clean_json_aggressively(json_str)
-            
-            # Step 4: Try to parse
-            result = json.loads(json_str)
+            result, _ = _DECODER.raw_decode(cleaned_text, json_start)
             logger.info(f"Successfully parsed Gemini JSON for {context}")
             return result
             
@@ -249,33 +457,18 @@ class PdfAnalysisService:
             # Look for key patterns and extract manually
             if "extracted_values" in response_text or "potential_sources" in response_text or "batch_analysis" in response_text:
                 # Try to find array content
-                for key in ["extracted_values", "potential_sources", "batch_analysis"]:
-                    start_pattern = rf'"{key}"\s*:\s*\['
-                    
-                    match = re.search(start_pattern, response_text)
+                for key, start_pattern in _KEY_PATTERNS.items():
+                    match = start_pattern.search(response_text)
                     if match:
                         start_pos = match.end() - 1  # Include the [
                         
-                        # Find matching closing bracket
-                        bracket_count = 0
-                        end_pos = -1
-                        for i in range(start_pos, len(response_text)):
-                            if response_text[i] == '[':
-                                bracket_count += 1
-                            elif response_text[i] == ']':
-                                bracket_count -= 1
-                                if bracket_count == 0:
-                                    end_pos = i
-                                    break
-                        
-                        if end_pos != -1:
-                            array_content = response_text[start_pos:end_pos + 1]
-                            # Try to parse just this array
-                            try:
-                                extracted_array = json.loads(array_content)
-                                return {key: extracted_array}
-                            except:
-                                continue
+                        # Try to parse just this array
+                        try:
+                            extracted_array, _ = _DECODER.raw_decode(response_text, start_pos)
+                            # Flagged so callers don't keep a salvaged response cached
+                            return {key: extracted_array, "recovered": True}
+                        except json.JSONDecodeError:
+                            continue
             
         except:
             pass
@@ -4,6 +4,7 @@ from app.services.ai_service import ai_service
 from app.models.document import ValidationStatus
 import asyncio
 import re
+from collections import Counter
 
 logger = structlog.get_logger()
 
@@ -45,6 +46,7 @@ class AuditService:
             all_results.extend(batch_results)
         
         # Process results
+        status_counts = Counter()
         for result in all_results:
             if isinstance(result, Exception):
                 logger.error("Validation task failed", error=str(result))
@@ -52,17 +54,17 @@ class AuditService:
             
             if result:
                 audit_results["detailed_results"].append(result)
-                audit_results["summary"]["total_values_checked"] += 1
-                
-                status = result["validation_status"]
-                if status == ValidationStatus.MATCHED:
-                    audit_results["summary"]["matched"] += 1
-                elif status == ValidationStatus.MISMATCHED:
-                    audit_results["summary"]["mismatched"] += 1
-                elif status == ValidationStatus.FORMATTING_ERROR:
-                    audit_results["summary"]["formatting_errors"] += 1
-                else:
-                    audit_results["summary"]["unverifiable"] += 1
+                status_counts[result["validation_status"]] += 1
+        
+        # Any status other than the three tallied ones counts as unverifiable
+        summary = audit_results["summary"]
+        summary["total_values_checked"] = len(audit_results["detailed_results"])
+        summary["matched"] = status_counts[ValidationStatus.MATCHED]
+        summary["mismatched"] = status_counts[ValidationStatus.MISMATCHED]
+        summary["formatting_errors"] = status_counts[ValidationStatus.FORMATTING_ERROR]
+        summary["unverifiable"] = (
+            summary["total_values_checked"] - summary["matched"] - summary["mismatched"] - summary["formatting_errors"]
+        )
         
         # Calculate overall accuracy
         total = audit_results["summary"]["total_values_checked"]
@@ -1,31 +1,115 @@
 import google.generativeai as genai
-from typing import Dict, Any, List, Tuple, Optional
+from typing import Dict, Any, List, Literal, Tuple, Optional, Union
 import json
-import base64
+import math
+import orjson
 import structlog
-from PIL import Image
-import io
-import time
 import faiss
 import asyncio
+import copy
 import os
-import fitz  # PyMuPDF
-import pandas as pd
 from decouple import config
 import re
 from datetime import datetime
-import math
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 import hashlib
-from openpyxl import load_workbook
+from collections import Counter, OrderedDict
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
 from app.services.audit.pdf_analysis import PdfAnalysisService
-from app.services.audit.excel_analysis import ExcelAuditSystem
+from app.services.audit.embeddings import embed_texts, embedding_model_id
+from app.services.audit.excel_analysis import EMBED_BATCH_SIZE, ExcelAuditSystem, maybe_index_to_gpu
 from app.services.audit.fuzzy_matching import FuzzyMatchService
+from app.services.audit.gemini_cache import get_gemini_cache
+from app.services.audit.gemini_limiter import estimate_tokens, get_gemini_limiter
 
 # Configure logging
 logger = structlog.get_logger()
 
+# Shared JSON decoder and the markdown fence Gemini sometimes wraps its JSON in
+_DECODER = json.JSONDecoder()
+_FENCE_RE = re.compile(r'^```(?:json)?|```$')
+# One scan finds whichever result array the response carries
+_RECOVERY_RE = re.compile(r'"(batch_results|extracted_values|potential_sources|batch_analysis)"\s*:\s*\[')
+_ARRAY_SEPARATOR_RE = re.compile(r'\s*,?\s*')
+
+
+class _AuditResultItem(BaseModel):
+    """The fields of one Gemini audit result that downstream code relies on; other keys pass through"""
+    model_config = ConfigDict(extra='allow')
+
+    pdf_value_id: Union[str, int, None] = None
+    validation_status: Literal['matched', 'mismatched', 'unverifiable']
+    confidence: float = 0.0
+    excel_match: Optional[Dict[str, Any]] = None
+
+    @field_validator('validation_status', mode='before')
+    @classmethod
+    def _normalize_status(cls, value):
+        return value.strip().lower() if isinstance(value, str) else value
+
+    @field_validator('confidence', mode='before')
+    @classmethod
+    def _coerce_confidence(cls, value):
+        # An odd confidence ("95%", "high", null) is not worth discarding a usable verdict over
+        try:
+            if isinstance(value, str):
+                text = value.strip()
+                confidence = float(text.rstrip('%')) / 100 if text.endswith('%') else float(text)
+            else:
+                confidence = float(value)
+        except (TypeError, ValueError):
+            return 0.0
+        if not math.isfinite(confidence):
+            return 0.0
+        # 0-100 scores are percentages
+        if 1.0 < confidence <= 100.0:
+            confidence /= 100
+        return min(max(confidence, 0.0), 1.0)
+
+
+def _validate_audit_item(item: Any) -> Optional[dict]:
+    """A validated audit result, or None when the item is malformed"""
+    try:
+        return _AuditResultItem.model_validate(item).model_dump(exclude_unset=True)
+    except ValidationError:
+        return None
+
+
+def _decode_array_items(text: str, start: int) -> list:
+    """
+    Decode the elements of the JSON array opening at text[start] one raw_decode call at a time,
+    keeping every complete element before the point where a truncated response breaks off.
+    """
+    items = []
+    pos = _ARRAY_SEPARATOR_RE.match(text, start + 1).end()
+    while pos < len(text) and text[pos] != ']':
+        try:
+            item, pos = _DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            break
+        items.append(item)
+        pos = _ARRAY_SEPARATOR_RE.match(text, pos).end()
+    return items
+
+# PDF values per audit prompt: small enough that prompt + response stay well inside the model's limits
+AUDIT_BATCH_SIZE = config('AUDIT_BATCH_SIZE', default=10, cast=int)
+# Rough token budget for the PDF values of one batch; verbose values close a batch early
+AUDIT_BATCH_TOKEN_BUDGET = config('AUDIT_BATCH_TOKEN_BUDGET', default=2000, cast=int)
+# When set, each batch's prompt and parsed result are written here for debugging
+AUDIT_DEBUG_DUMP_DIR = config('AUDIT_DEBUG_DUMP_DIR', default='')
+# Search-time recall/speed knobs for approximate indexes; 0 keeps the value stored with the index
+FAISS_NPROBE = config('FAISS_NPROBE', default=0, cast=int)
+FAISS_EF_SEARCH = config('FAISS_EF_SEARCH', default=0, cast=int)
+# Reuse an earlier audit result for the same value when its query embedding is at least this similar
+SEMANTIC_CACHE_MIN_SIMILARITY = config('SEMANTIC_CACHE_MIN_SIMILARITY', default=0.97, cast=float)
+# A value whose only fuzzy match at or above this confidence is an exact match is accepted without asking Gemini
+FUZZY_AUTO_ACCEPT_CONFIDENCE = config('FUZZY_AUTO_ACCEPT_CONFIDENCE', default=0.95, cast=float)
+# Number of query-text embeddings remembered across batches and runs
+EMBEDDING_CACHE_SIZE = 8192
+# Distinct values, and results per value, kept in the semantic result cache
+SEMANTIC_CACHE_SIZE = 8192
+SEMANTIC_CACHE_ENTRIES_PER_VALUE = 8
+
 class EnhancedGeminiService:
 
     def __init__(self):
@@ -38,10 +122,21 @@ class EnhancedGeminiService:
         self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
         self.ai_enabled = True
         self.vector_db_path = None
-        # Improved embedding model
-        self.embedding_model_name = 'models/embedding-001'
+        # Must match the model the FAISS index was built with (EMBEDDING_BACKEND)
+        self.embedding_model_name = embedding_model_id()
         self.context_json_path = "faiss_db/contexts.json"
         self.fuzzy_match_service = FuzzyMatchService()
+        # (path, mtime, size) of the loaded index and contexts files, to skip reloading unchanged ones
+        self._vector_db_signature = None
+        # Semantic result cache for the loaded vector database:
+        # normalized value -> [(L2-normalized query embedding, audit result)], LRU-ordered
+        self._semantic_cache: "OrderedDict[str, List[Tuple[np.ndarray, dict]]]" = OrderedDict()
+        # SHA-256 of a query text -> its embedding, LRU-ordered
+        self._embedding_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.response_cache = get_gemini_cache()
+        self.limiter = get_gemini_limiter()
+        # Bounds how many batches run fuzzy matching, embeddings and prompt building at once
+        self._audit_semaphore = asyncio.Semaphore(config('AUDIT_BATCH_CONCURRENCY', default=5, cast=int))
         
         logger.info("Enhanced Gemini Service initialized with improved extraction algorithms")
 
@@ -64,7 +159,8 @@ class EnhancedGeminiService:
         logger.info(f"Starting enhanced Excel analysis: {excel_path}")
         try:
             ea = ExcelAuditSystem()
-            result = ea.analyse_excel_comprehensive(excel_path)
+            # Parsing, embedding requests and the FAISS build are all blocking; run them off the event loop
+            result = await asyncio.to_thread(ea.analyse_excel_comprehensive, excel_path)
             # print(result)
             self.vector_db_path = result.faiss_index_path
             analysed_values = result.analysedValues
@@ -83,7 +179,7 @@ class EnhancedGeminiService:
             logger.error(f"Excel extraction failed: {e}")
             raise
 
-    async def run_direct_comprehensive_audit(self, pdf_json_data: dict, batch_size: int = 10):
+    async def run_direct_comprehensive_audit(self, pdf_json_data: dict, batch_size: int = AUDIT_BATCH_SIZE):
         """Process PDF values against FAISS vector database and send to LLM for final validation"""
         pdf_values = pdf_json_data
         faiss_index_path = 'faiss_db/faiss_index.index'
@@ -93,19 +189,31 @@ class EnhancedGeminiService:
         if not self.load_vector_database(faiss_index_path, context_json_path=self.context_json_path):
             return {"error": "Failed to load vector database"}
 
-        all_results = [] 
-        total_batches = math.ceil(len(pdf_values) / batch_size)
-
-        for batch_num in range(total_batches):
-            start_idx = batch_num * batch_size
-            end_idx = min((batch_num + 1) * batch_size, len(pdf_values))
-            batch = pdf_values[start_idx:end_idx]
-
-            logger.info(f"Processing batch {batch_num + 1}/{total_batches} ({len(batch)} values)")
-            batch_results = await self._process_vector_audit_batch(batch, batch_num + 1, total_batches)
-            all_results.extend(batch_results)
-
-            await asyncio.sleep(1)  # rate limiting
+        # Values with a single exact numeric match in the workbook are settled without the LLM,
+        # so only the rest are packed into batches
+        all_results = [None] * len(pdf_values)
+        llm_indices = []
+        for i, pdf_value in enumerate(pdf_values):
+            excel_row = self.fuzzy_match_service.find_unique_exact_match(pdf_value.get('value', ''))
+            if excel_row is not None:
+                all_results[i] = self._local_match_result(pdf_value, excel_row)
+            else:
+                llm_indices.append(i)
+        logger.info(f"{len(pdf_values) - len(llm_indices)} values matched exactly without the LLM")
+
+        batches = self._plan_audit_batches(pdf_values, llm_indices, max(1, batch_size), AUDIT_BATCH_TOKEN_BUDGET)
+        total_batches = len(batches)
+        logger.info(f"Dispatching {total_batches} audit batches of up to {batch_size} values")
+
+        # Batches are independent; the semaphore caps batch preparation and the shared limiter schedules the requests
+        batch_results = await asyncio.gather(*[
+            self._audit_batch_with_llm([pdf_values[i] for i in batch], batch_num, total_batches)
+            for batch_num, batch in enumerate(batches, start=1)
+        ])
+        # Batches are grouped by category, so put results back in the original PDF order
+        for batch, results in zip(batches, batch_results):
+            for i, result in zip(batch, results):
+                all_results[i] = result
 
         return {
             "summary": self._calculate_vector_audit_summary(all_results),
@@ -113,57 +221,322 @@ class EnhancedGeminiService:
             "total_processed": len(pdf_values)
         }
 
+    @staticmethod
+    def _plan_audit_batches(pdf_values: list, indices: List[int], max_size: int, token_budget: int) -> List[List[int]]:
+        """
+        Group the given PDF value indices into audit batches. Values of the same business category are kept
+        together so one prompt covers related figures, and a batch closes at max_size values or
+        once its serialized values exceed the token budget.
+        """
+        order = sorted(
+            indices,
+            key=lambda i: pdf_values[i].get('business_context', {}).get('business_category', '')
+        )
+        batches, current, current_tokens = [], [], 0
+        for i in order:
+            tokens = estimate_tokens(orjson.dumps(pdf_values[i], default=str).decode())
+            if current and (len(current) >= max_size or current_tokens + tokens > token_budget):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
     def load_vector_database(self, faiss_index_path: str, context_json_path: str) -> bool:
         """Load FAISS index and contexts from disk"""
         try:
-            self.faiss_index = faiss.read_index(faiss_index_path)
+            signature = tuple(
+                (path, stat.st_mtime_ns, stat.st_size)
+                for path, stat in ((p, os.stat(p)) for p in (faiss_index_path, context_json_path))
+            )
+            if signature == self._vector_db_signature:
+                logger.info("Vector database unchanged since last load, reusing it")
+                return True
+            self._vector_db_signature = None
+            # Results audited against the previous workbook no longer apply
+            self._semantic_cache.clear()
+
+            # Query vectors from a different model than the index would search a meaningless space
+            meta_path = os.path.splitext(faiss_index_path)[0] + ".meta.json"
+            if os.path.exists(meta_path):
+                with open(meta_path, "rb") as f:
+                    index_model = orjson.loads(f.read()).get("embedding_model", "models/embedding-001")
+                if index_model != self.embedding_model_name:
+                    raise ValueError(
+                        f"FAISS index was built with {index_model} but queries use {self.embedding_model_name}; "
+                        f"rebuild the index"
+                    )
+
+            faiss_index = faiss.read_index(faiss_index_path)
+            if FAISS_NPROBE and isinstance(faiss_index, faiss.IndexIVF):
+                faiss_index.nprobe = FAISS_NPROBE
+            if FAISS_EF_SEARCH and hasattr(faiss_index, "hnsw"):
+                faiss_index.hnsw.efSearch = FAISS_EF_SEARCH
+            # HNSW indexes stay on CPU; the others can be served from GPU when FAISS_GPU is set
+            index_type = "hnsw" if "HNSW" in type(faiss_index).__name__ else type(faiss_index).__name__
+            self.faiss_index = maybe_index_to_gpu(faiss_index, index_type)
             logger.info(f"Loaded FAISS index with {self.faiss_index.ntotal} vectors")
 
-            with open(context_json_path, "r", encoding="utf-8") as f:
-                self.contexts = json.load(f)
+            with open(context_json_path, "rb") as f:
+                self.contexts = orjson.loads(f.read())
             logger.info(f"Loaded {len(self.contexts)} contexts from {context_json_path}")
+            # Column-wise views of the fields read for every vector hit
+            self._ctx_values = [ctx.get("value") for ctx in self.contexts]
+            self._ctx_cells = [ctx.get("cell_address") for ctx in self.contexts]
+            self._ctx_full_contexts = [ctx.get("full_context") for ctx in self.contexts]
+            self._ctx_titles = [ctx.get("table_title") for ctx in self.contexts]
             # Pre-load Excel data for fuzzy matching
             if not self.fuzzy_match_service.load_excel_data(self.contexts):
                 logger.warning("Fuzzy matching data loading failed, but continuing without fuzzy matching")
             
+            self._vector_db_signature = signature
             return True
         except Exception as e:
             logger.error(f"Failed to load vector database: {e}")
             return False
 
-    async def _process_vector_audit_batch(self, pdf_batch: list, batch_num: int, total_batches: int):
-        """Process a batch of PDF values using fuzzy + vector search and LLM validation"""
-        # Perform fuzzy matching first
-        fuzzy_results = await self._perform_fuzzy_matching(pdf_batch)
+    @staticmethod
+    def _local_match_result(pdf_value: dict, excel_row: dict) -> dict:
+        """Audit result for a PDF value whose number appears in exactly one Excel cell"""
+        sheet = excel_row.get('sheet_name', '')
+        cell = excel_row.get('cell_address', '')
+        return {
+            "pdf_value_id": pdf_value.get('id'),
+            "pdf_value": pdf_value.get('value'),
+            "pdf_context": pdf_value.get('business_context', {}).get('semantic_meaning', ''),
+            "validation_status": "matched",
+            "excel_match": {
+                "source_cell": f"{sheet}!{cell}",
+                "Excel_Cell_used_for_match": cell,
+                "Source_Sheet": sheet,
+                "excel_value": excel_row.get('value'),
+                "match_confidence": 1.0,
+                "calculation_basis": "direct_match",
+                "match_source": "fuzzy"
+            },
+            "confidence": 1.0,
+            "audit_reasoning": f"Exact numeric match with the only Excel cell holding this value ({sheet}!{cell}: "
+                               f"{excel_row.get('table_title', '')})"
+        }
+
+    async def _audit_batch_with_llm(self, pdf_batch: list, batch_num: int, total_batches: int):
+        """Validate PDF values using fuzzy + vector search and LLM validation"""
+        # Only preparation holds a semaphore slot, so later batches prepare while this one waits on Gemini
+        async with self._audit_semaphore:
+            # The embedding request and fuzzy matching (worker threads) run concurrently
+            embeddings, fuzzy_results = await asyncio.gather(
+                self._generate_embeddings([self._query_text(pdf_value) for pdf_value in pdf_batch]),
+                self._perform_fuzzy_matching(pdf_batch)
+            )
+            # Context vectors are stored L2-normalized in an inner-product index, so unit queries score cosine
+            faiss.normalize_L2(embeddings)
+            cached = self._semantic_cache_lookup(pdf_batch, embeddings)
+            auto_matched = {}
+            for i in range(len(pdf_batch)):
+                if i not in cached and i < len(fuzzy_results):
+                    match = self._confident_fuzzy_match(pdf_batch[i], fuzzy_results[i])
+                    if match is not None:
+                        auto_matched[i] = self._fuzzy_match_result(pdf_batch[i], match)
+            resolved = {**cached, **auto_matched}
+            pending = [i for i in range(len(pdf_batch)) if i not in resolved]
+            if pending:
+                prompt = self._build_vector_audit_prompt(
+                    [pdf_batch[i] for i in pending], embeddings[pending],
+                    [fuzzy_results[i] if i < len(fuzzy_results) else None for i in pending],
+                    batch_num, total_batches
+                )
         
+        if cached:
+            logger.info(f"Vector batch {batch_num}: {len(cached)} values reused from earlier audits")
+        if auto_matched:
+            logger.info(f"Vector batch {batch_num}: {len(auto_matched)} values accepted from fuzzy matches")
+        llm_results = iter(
+            await self._run_audit_prompt(prompt, [pdf_batch[i] for i in pending], embeddings[pending], batch_num)
+            if pending else ()
+        )
+        return [resolved[i] if i in resolved else next(llm_results) for i in range(len(pdf_batch))]
+
+    def _confident_fuzzy_match(self, pdf_value: dict, fuzzy_result: Optional[dict]) -> Optional[dict]:
+        """
+        The fuzzy match to accept outright: the only match reaching FUZZY_AUTO_ACCEPT_CONFIDENCE, and an
+        exact match on the raw value. Numeric-tolerance and punctuation-insensitive string hits
+        (e.g. "-12.5%" vs "12.5", "(3.2)" vs "3.2") always go to Gemini.
+        """
+        if not fuzzy_result:
+            return None
+        # Several equally good cells (e.g. a repeated total) are ambiguous; Gemini picks between them
+        confident = [m for m in fuzzy_result.get('fuzzy_matches', []) if m['confidence'] >= FUZZY_AUTO_ACCEPT_CONFIDENCE]
+        if len(confident) != 1 or confident[0].get('match_type') != 'exact_value':
+            return None
+        match = confident[0]
+        if not self.fuzzy_match_service.is_trusted_exact_match(pdf_value.get('value', ''), match.get('excel_value', '')):
+            return None
+        return match
+
+    @staticmethod
+    def _fuzzy_match_result(pdf_value: dict, match: dict) -> dict:
+        """Audit result for a PDF value accepted on a single high-confidence fuzzy match"""
+        sheet = match.get('excel_sheet', '')
+        cell = match.get('excel_location', '')
+        return {
+            "pdf_value_id": pdf_value.get('id'),
+            "pdf_value": pdf_value.get('value'),
+            "pdf_context": pdf_value.get('business_context', {}).get('semantic_meaning', ''),
+            "validation_status": "matched",
+            "excel_match": {
+                "source_cell": f"{sheet}!{cell}",
+                "Excel_Cell_used_for_match": cell,
+                "Source_Sheet": sheet,
+                "excel_value": match.get('excel_value'),
+                "match_confidence": match['confidence'],
+                "calculation_basis": "direct_match",
+                "match_source": "fuzzy"
+            },
+            "confidence": match['confidence'],
+            "audit_reasoning": f"Auto-accepted high-confidence {match.get('match_type', 'fuzzy')} match "
+                               f"({sheet}!{cell}: {match.get('business_context', '')})"
+        }
+
+    @staticmethod
+    def _query_text(pdf_value: dict) -> str:
+        """Text embedded to search the vector database for a PDF value"""
+        business_context = pdf_value.get('business_context', {})
+        return f"Value: {pdf_value['value']} | Context: {business_context.get('semantic_meaning', '')} | Category: {business_context.get('business_category', '')} | Type: {business_context.get('calculation_type', '')}"
+
+    def _semantic_cache_lookup(self, pdf_batch: list, embeddings: np.ndarray) -> Dict[int, dict]:
+        """Earlier results for values identical to, and described almost exactly like, values in this batch"""
+        hits = {}
+        for i, pdf_value in enumerate(pdf_batch):
+            key = FuzzyMatchService._normalize_exact(pdf_value.get('value', ''))
+            entries = self._semantic_cache.get(key)
+            if not entries:
+                continue
+            for cached_embedding, result in entries:
+                if float(embeddings[i] @ cached_embedding) >= SEMANTIC_CACHE_MIN_SIMILARITY:
+                    # Deep copies: a reused result must not share nested dicts (excel_match) with the cache
+                    hits[i] = {**copy.deepcopy(result), "pdf_value_id": pdf_value.get('id'), "pdf_value": pdf_value.get('value')}
+                    self._semantic_cache.move_to_end(key)
+                    break
+        return hits
+
+    def _semantic_cache_store(self, pdf_value: dict, embedding: np.ndarray, result: dict):
+        key = FuzzyMatchService._normalize_exact(pdf_value.get('value', ''))
+        entries = self._semantic_cache.setdefault(key, [])
+        entries.append((embedding, copy.deepcopy(result)))
+        # Both the number of values and the results per value are bounded, oldest first
+        del entries[:-SEMANTIC_CACHE_ENTRIES_PER_VALUE]
+        self._semantic_cache.move_to_end(key)
+        while len(self._semantic_cache) > SEMANTIC_CACHE_SIZE:
+            self._semantic_cache.popitem(last=False)
+
+    async def _run_audit_prompt(self, prompt: str, pdf_batch: list, embeddings: np.ndarray, batch_num: int) -> list:
+        """Send a batch's audit prompt to Gemini and map the answers back onto its PDF values"""
+        if AUDIT_DEBUG_DUMP_DIR:
+            await self._dump_debug(f"prompt_batch_{batch_num}.txt", prompt.encode('utf-8'))
+
+        try:
+            cache_key = self.response_cache.make_key(self.model.model_name, prompt)
+            response_text = await self.response_cache.get_or_generate(
+                cache_key,
+                lambda: self.limiter.call(
+                    lambda: self.model.generate_content_async(prompt),
+                    estimated_tokens=estimate_tokens(prompt),
+                    context=f"vector_audit_batch_{batch_num}"
+                ),
+                doc_id="vector_audit"
+            )
+            result = await self._parse_gemini_json_response_robust(response_text, f"vector_audit_batch_{batch_num}")
+            if AUDIT_DEBUG_DUMP_DIR:
+                await self._dump_debug(f"parsed_result_batch_{batch_num}.json", orjson.dumps(result, default=str))
+            
+            # Each item is validated on its own: a malformed one only costs its own value.
+            # Invalid items stay as None so the positional fallback below stays aligned.
+            batch_results = [_validate_audit_item(r) for r in result.get("batch_results", [])]
+            invalid = sum(r is None for r in batch_results)
+            if invalid:
+                logger.warning(f"Vector batch {batch_num}: {invalid} malformed results replaced with fallbacks")
+
+            # Match results to values by id, so skipped or reordered results don't shift onto the wrong value.
+            # Ids come from the extraction model and can repeat; only ids unique in the batch are looked up.
+            id_counts = Counter(str(pdf_value.get('id')) for pdf_value in pdf_batch)
+            by_id = {}
+            for r in batch_results:
+                if r is not None:
+                    by_id.setdefault(str(r.get("pdf_value_id")), r)
+            
+            final_results = []
+            incomplete = False
+            for i, pdf_value in enumerate(pdf_batch):
+                pdf_id = str(pdf_value.get('id'))
+                positional = batch_results[i] if i < len(batch_results) else None
+                positional_id = str(positional.get("pdf_value_id")) if positional is not None else None
+                batch_result = by_id.get(pdf_id) if id_counts[pdf_id] == 1 else None
+                if batch_result is not None:
+                    # Only results Gemini tied to this value by a unique id are trusted for reuse
+                    self._semantic_cache_store(pdf_value, embeddings[i], batch_result)
+                elif positional is not None and (positional_id == pdf_id or positional_id not in id_counts):
+                    # A repeated id, or one Gemini dropped or mangled: use the result in this position
+                    batch_result = positional
+                else:
+                    # fallback if Gemini response is incomplete
+                    incomplete = True
+                    batch_result = {
+                        "pdf_value_id": pdf_value.get('id'),
+                        "pdf_value": pdf_value.get('value'),
+                        "validation_status": "unverifiable",
+                        "confidence": 0.0
+                    }
+                final_results.append(batch_result)
+
+            if result.get("error") or result.get("recovered") or incomplete:
+                # Don't replay a response we could not fully parse, or one that left values
+                # without a result; a re-run asks Gemini again
+                self.response_cache.invalidate(cache_key)
+
+            logger.info(f"Vector batch {batch_num}: Processed {len(final_results)} PDF values")
+            return final_results
+
+        except Exception as e:
+            logger.error(f"Vector audit batch {batch_num} failed: {e}")
+            return [{
+                "pdf_value_id": pdf_value.get('id'),
+                "pdf_value": pdf_value.get('value'),
+                "validation_status": "unverifiable",
+                "confidence": 0.0,
+                "error": str(e)
+            } for pdf_value in pdf_batch]
+
+    def _build_vector_audit_prompt(self, pdf_batch: list, embeddings: np.ndarray, fuzzy_results: list,
+                                   batch_num: int, total_batches: int) -> str:
+        """Search vector matches for a batch and build its audit prompt around them and the fuzzy matches"""
         enhanced_batch = []
         
+        # One search for the whole batch: FAISS parallelizes multi-query searches, single queries run serially
+        D, I = self.faiss_index.search(embeddings, k=5)
+        n_contexts = len(self._ctx_values)
+        
         for i, pdf_value in enumerate(pdf_batch):
             # Get fuzzy matches for this value
             fuzzy_matches = []
             if i < len(fuzzy_results) and fuzzy_results[i]:
                 fuzzy_matches = fuzzy_results[i].get('fuzzy_matches', [])
             
-            # Build query text for vector search (existing code)
             business_context = pdf_value.get('business_context', {})
-            query_text = f"Value: {pdf_value['value']} | Context: {business_context.get('semantic_meaning', '')} | Category: {business_context.get('business_category', '')} | Type: {business_context.get('calculation_type', '')}"
-
-            # Generate embedding and search FAISS (existing code)
-            embedding = await self._generate_embedding(query_text)
-            D, I = self.faiss_index.search(np.array([embedding]).astype('float32'), k=5)
             
-            vector_matches = []
-            for idx, score in zip(I[0], D[0]):
-                if idx < len(self.contexts):
-                    ctx = self.contexts[idx]
-                    vector_matches.append({
-                        "excel_value": ctx.get("value"),
-                        "excel_location": ctx.get("cell_address"),
-                        "excel_context": ctx.get("full_context"),
-                        "confidence": float(score),
-                        "match_type": "vector_match",
-                        "business_context": ctx.get("table_title")
-                    })
+            vector_matches = [
+                {
+                    "excel_value": self._ctx_values[idx],
+                    "excel_location": self._ctx_cells[idx],
+                    "excel_context": self._ctx_full_contexts[idx],
+                    "confidence": score,
+                    "match_type": "vector_match",
+                    "business_context": self._ctx_titles[idx]
+                }
+                # FAISS pads with -1 when fewer than k neighbours exist
+                for idx, score in zip(I[i].tolist(), D[i].tolist()) if 0 <= idx < n_contexts
+            ]
 
             enhanced_batch.append({
                 "id": pdf_value.get('id'),
@@ -180,7 +553,7 @@ class EnhancedGeminiService:
     You are auditing presentation values against Excel source data using FUZZY matches and VECTOR database matches.
 
     BATCH {batch_num}/{total_batches} PDF VALUES TO VALIDATE:
-    {json.dumps(enhanced_batch, indent=1)}
+    {orjson.dumps(enhanced_batch, default=str).decode()}
 
     For EACH PDF value (process them in order):
     1. FIRST check FUZZY matches (exact, numeric, similar values)
@@ -234,46 +607,19 @@ class EnhancedGeminiService:
     2. For calculated values, set the validation_status as matched and show the calculation in audit_reasoning
     3. Return ONLY valid JSON, no other text
 """
-        
-        # with open('prompt.txt','w',encoding='utf-8') as f:
-        #     f.write(prompt)
-        #     f.write("====================================")
-
+        return prompt
+
+    @staticmethod
+    async def _dump_debug(filename: str, data: bytes):
+        """Write a debug artifact to AUDIT_DEBUG_DUMP_DIR without blocking the event loop"""
+        def write():
+            os.makedirs(AUDIT_DEBUG_DUMP_DIR, exist_ok=True)
+            with open(os.path.join(AUDIT_DEBUG_DUMP_DIR, filename), 'wb') as f:
+                f.write(data)
         try:
-            response = self.model.generate_content(prompt)
-            result = await self._parse_gemini_json_response_robust(response.text, f"vector_audit_batch_{batch_num}")
-            # with open('result.txt','w',encoding='utf-8') as f:
-            #     f.write(str(result))
-            #     f.write("====================================")
-            
-            batch_results = result.get("batch_results", [])
-
-            # Ensure correct number of results
-            final_results = []
-            for i, pdf_value in enumerate(pdf_batch):
-                if i < len(batch_results):
-                    final_results.append(batch_results[i])
-                else:
-                    # fallback if Gemini response is incomplete
-                    final_results.append({
-                        "pdf_value_id": pdf_value.get('id'),
-                        "pdf_value": pdf_value.get('value'),
-                        "validation_status": "unverifiable",
-                        "confidence": 0.0
-                    })
-
-            logger.info(f"Vector batch {batch_num}: Processed {len(final_results)} PDF values")
-            return final_results
-
-        except Exception as e:
-            logger.error(f"Vector audit batch {batch_num} failed: {e}")
-            return [{
-                "pdf_value_id": pdf_value.get('id'),
-                "pdf_value": pdf_value.get('value'),
-                "validation_status": "unverifiable",
-                "confidence": 0.0,
-                "error": str(e)
-            } for pdf_value in pdf_batch]
+            await asyncio.to_thread(write)
+        except OSError as e:
+            logger.warning(f"Could not write debug dump {filename}: {e}")
 
     async def _perform_fuzzy_matching(self, pdf_batch: List[Dict]) -> List[Dict]:
             """Perform fuzzy matching before vector matching"""
@@ -293,52 +639,55 @@ class EnhancedGeminiService:
                 logger.error(f"Fuzzy matching failed: {e}")
                 return []
 
-    async def _generate_embedding(self, text: str):
-        """Generate embedding using Gemini API"""
-        result = genai.embed_content(model="models/embedding-001", content=text)
-        return np.array(result['embedding']).astype('float32')
+    async def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts with the configured backend, EMBED_BATCH_SIZE per call; returns an (N, D) float32 matrix.
+        Texts embedded before (in this or an earlier batch) are served from the embedding cache.
+        """
+        keys = [hashlib.sha256(text.encode('utf-8')).digest() for text in texts]
+        unique = dict(zip(keys, texts))
+        # Copy the hits out now: other batches may evict them while this one awaits the API
+        found = {key: self._embedding_cache[key] for key in unique if key in self._embedding_cache}
+        miss_keys = [key for key in unique if key not in found]
+        
+        for start in range(0, len(miss_keys), EMBED_BATCH_SIZE):
+            batch_keys = miss_keys[start:start + EMBED_BATCH_SIZE]
+            # Both backends block (HTTP call or model inference); keep them off the event loop
+            batch_embeddings = await asyncio.to_thread(embed_texts, [unique[key] for key in batch_keys])
+            for key, embedding in zip(batch_keys, batch_embeddings):
+                found[key] = embedding
+        
+        for key, embedding in found.items():
+            self._embedding_cache[key] = embedding
+            self._embedding_cache.move_to_end(key)
+        while len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+            self._embedding_cache.popitem(last=False)
+        if len(miss_keys) < len(texts):
+            logger.info(f"Embedded {len(miss_keys)} new query texts, {len(texts) - len(miss_keys)} served from cache")
+        # np.stack copies, so callers may normalize the matrix in place without touching the cache
+        return np.stack([found[key] for key in keys])
 
     async def _parse_gemini_json_response_robust(self, response_text: str, context: str) -> Dict[str, Any]:
         """Robust JSON parsing for Gemini responses with multiple fallback strategies"""
         try:
-            # Step 1: Basic cleaning
-            cleaned_text = response_text.strip()
-            
-            # Remove common markdown formatting
-            if cleaned_text.startswith("```json"):
-                cleaned_text = cleaned_text[7:]
-            elif cleaned_text.startswith("```"):
-                cleaned_text = cleaned_text[3:]
-            
-            if cleaned_text.endswith("```"):
-                cleaned_text = cleaned_text[:-3]
-            
-            # Step 2: Find JSON boundaries more carefully
-            json_start = -1
-            json_end = -1
-            brace_count = 0
+            # Step 1: Fast path for a compliant response that is exactly one JSON object
+            try:
+                result = orjson.loads(response_text)
+                if isinstance(result, dict):
+                    logger.info(f"Successfully parsed Gemini JSON for {context}")
+                    return result
+            except orjson.JSONDecodeError:
+                pass
             
-            for i, char in enumerate(cleaned_text):
-                if char == '{':
-                    if json_start == -1:
-                        json_start = i
-                    brace_count += 1
-                elif char == '}':
-                    brace_count -= 1
-                    if brace_count == 0 and json_start != -1:
-                        json_end = i
-                        break
+            # Step 2: Basic cleaning, removing markdown fences
+            cleaned_text = _FENCE_RE.sub('', response_text.strip())
             
-            if json_start == -1 or json_end == -1:
+            # Step 3: Parse the first JSON object; raw_decode finds its end in C and ignores trailing text
+            json_start = cleaned_text.find('{')
+            if json_start == -1:
                 raise ValueError(f"No complete JSON object found in response for {context}")
             
-            json_str = cleaned_text[json_start:json_end + 1]
-            
-            # Step 3: Advanced JSON cleaning
-            # json_str = self._clean_json_aggressively(json_str)
-            
-            # Step 4: Try to parse
-            result = json.loads(json_str)
+            result, _ = _DECODER.raw_decode(cleaned_text, json_start)
             logger.info(f"Successfully parsed Gemini JSON for {context}")
             return result
             
@@ -351,17 +700,48 @@ class EnhancedGeminiService:
             logger.error(f"Unexpected parsing error for {context}: {e}")
             return self._get_fallback_structure(context)
 
+    async def _json_recovery_strategies(self, response_text: str, context: str) -> Dict[str, Any]:
+        """Recover the result array when the surrounding object does not parse"""
+        for match in _RECOVERY_RE.finditer(response_text):
+            array_start = match.end() - 1  # the [
+            try:
+                extracted_array, _ = _DECODER.raw_decode(response_text, array_start)
+            except json.JSONDecodeError:
+                # Typically a response cut off mid-array: keep the elements that did complete
+                extracted_array = _decode_array_items(response_text, array_start)
+                if not extracted_array:
+                    continue
+            logger.info(f"Recovered {len(extracted_array)} '{match.group(1)}' items from malformed JSON for {context}")
+            # Flagged so callers don't keep a possibly truncated response cached
+            return {match.group(1): extracted_array, "recovered": True}
+        
+        return self._get_fallback_structure(context)
+
+    def _get_fallback_structure(self, context: str) -> Dict[str, Any]:
+        """Empty result for a response that could not be parsed; the batch marks its values unverifiable"""
+        return {
+            "batch_results": [],
+            "error": f"JSON parsing failed for {context}"
+        }
+
     def _calculate_vector_audit_summary(self, results: list) -> dict:
         """Simple summary statistics"""
         total = len(results)
-        matched = sum(1 for r in results if r.get("validation_status") == "matched")
-        mismatched = sum(1 for r in results if r.get("validation_status") == "mismatched")
+        status_counts = Counter()
+        errored = 0
+        for r in results:
+            status_counts[r.get("validation_status")] += 1
+            if r.get("error"):
+                errored += 1
+        matched = status_counts["matched"]
+        mismatched = status_counts["mismatched"]
         unverifiable = total - matched - mismatched
         return {
             "total": total,
             "matched": matched,
             "mismatched": mismatched,
-            "unverifiable": unverifiable
+            "unverifiable": unverifiable,
+            "errored": errored
         }
 
 enhanced_gemini_service = EnhancedGeminiService()
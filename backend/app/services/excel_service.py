@@ -1,5 +1,5 @@
 import openpyxl
-import pandas as pd
+import numpy as np
 from typing import Dict, Any, List, Optional, Tuple
 import structlog
 from io import BytesIO
@@ -9,6 +9,10 @@ from datetime import datetime
 
 logger = structlog.get_logger()
 
+# Compiled once at import; used per formula / text cell
+_CELL_REF_RE = re.compile(r'[A-Z]+\d+')
+_SUMMARY_KEYWORD_RE = re.compile(r'total|sum|revenue|profit|loss|net|gross|ebitda', re.IGNORECASE)
+
 class ComprehensiveExcelService:
     def __init__(self):
         # Configuration for comprehensive extraction
@@ -24,9 +28,9 @@ class ComprehensiveExcelService:
         logger.info("Starting COMPREHENSIVE Excel data extraction - no artificial limits")
         
         try:
-            # Load workbook with comprehensive settings
-            workbook = openpyxl.load_workbook(BytesIO(file_content), data_only=True, read_only=False)
-            workbook_with_formulas = openpyxl.load_workbook(BytesIO(file_content), data_only=False, read_only=False)
+            # Load workbook with comprehensive settings; read-only mode streams rows instead of building the DOM
+            workbook = openpyxl.load_workbook(BytesIO(file_content), data_only=True, read_only=True)
+            workbook_with_formulas = openpyxl.load_workbook(BytesIO(file_content), data_only=False, read_only=True)
             
             total_sheets = len(workbook.sheetnames)
             sheets_to_process = min(total_sheets, self.max_sheets_to_process)
@@ -99,7 +103,9 @@ class ComprehensiveExcelService:
         """
         Extract comprehensive data from a single sheet - NO ARTIFICIAL LIMITS
         """
-        # Get ACTUAL sheet dimensions
+        # Get ACTUAL sheet dimensions (read-only sheets without a dimension record must be scanned)
+        if not (sheet.max_row and sheet.max_column):
+            sheet.calculate_dimension(force=True)
         actual_max_row = sheet.max_row or 1
         actual_max_col = sheet.max_column or 1
         
@@ -117,20 +123,23 @@ class ComprehensiveExcelService:
         date_cells = []
         percentage_cells = []
         currency_cells = []
-        
-        # Process ALL cells in the effective range
-        for row in range(1, effective_max_row + 1):
-            for col in range(1, effective_max_col + 1):
+        # Boolean occupancy grid (1-based), filled in the same pass for region detection
+        occupied = np.zeros((effective_max_row + 1, effective_max_col + 1), dtype=bool)
+        
+        # Process ALL cells in the effective range, streaming both sheets row by row in step
+        value_rows = sheet.iter_rows(min_row=1, max_row=effective_max_row, max_col=effective_max_col)
+        formula_rows = sheet_with_formulas.iter_rows(min_row=1, max_row=effective_max_row, max_col=effective_max_col)
+        for row, (value_row, formula_row) in enumerate(zip(value_rows, formula_rows), start=1):
+            for col, (cell, formula_cell) in enumerate(zip(value_row, formula_row), start=1):
                 try:
-                    cell = sheet.cell(row, col)
-                    
                     if cell.value is not None:
                         cell_ref = f"{openpyxl.utils.get_column_letter(col)}{row}"
                         
                         # Extract comprehensive cell information
-                        cell_info = await self._extract_comprehensive_cell_info(cell, sheet_with_formulas.cell(row, col), row, col)
+                        cell_info = await self._extract_comprehensive_cell_info(cell, formula_cell, row, col)
                         
                         cells_data[cell_ref] = cell_info
+                        occupied[row, col] = True
                         
                         # Categorize cells comprehensively
                         await self._categorize_cell_comprehensive(cell_info, cell_ref, numeric_cells, text_cells, formula_cells, date_cells, percentage_cells, currency_cells)
@@ -141,7 +150,7 @@ class ComprehensiveExcelService:
                     continue
         
         # Detect comprehensive data patterns
-        data_regions = await self._detect_comprehensive_data_regions(cells_data, effective_max_row, effective_max_col)
+        data_regions = await self._detect_comprehensive_data_regions(cells_data, occupied, effective_max_row, effective_max_col)
         
         # Identify high-priority cells (KPIs, summary metrics, etc.)
         high_priority_cells = await self._identify_high_priority_cells(numeric_cells, text_cells, formula_cells)
@@ -237,13 +246,14 @@ class ComprehensiveExcelService:
             
             # Analyze formula complexity
             formula_str = str(formula_cell.value)
+            formula_upper = formula_str.upper()
             cell_info["formula_complexity"] = {
-                "has_sum": "SUM" in formula_str.upper(),
-                "has_average": "AVERAGE" in formula_str.upper(),
-                "has_count": "COUNT" in formula_str.upper(),
-                "has_vlookup": "VLOOKUP" in formula_str.upper(),
-                "has_if": "IF" in formula_str.upper(),
-                "cell_references": len(re.findall(r'[A-Z]+\d+', formula_str)),
+                "has_sum": "SUM" in formula_upper,
+                "has_average": "AVERAGE" in formula_upper,
+                "has_count": "COUNT" in formula_upper,
+                "has_vlookup": "VLOOKUP" in formula_upper,
+                "has_if": "IF" in formula_upper,
+                "cell_references": len(_CELL_REF_RE.findall(formula_str)),
                 "is_complex": len(formula_str) > 20
             }
         else:
@@ -411,69 +421,69 @@ class ComprehensiveExcelService:
         
         return score
     
-    async def _detect_comprehensive_data_regions(self, cells_data: Dict, max_row: int, max_col: int) -> List[Dict]:
-        """Detect comprehensive data regions (tables, summary areas, etc.)"""
+    async def _detect_comprehensive_data_regions(self, cells_data: Dict, occupied: np.ndarray, max_row: int, max_col: int) -> List[Dict]:
+        """Detect comprehensive data regions (tables, summary areas, etc.) from the sheet's occupancy grid"""
         
         regions = []
-        processed_areas = set()
+        processed = np.zeros_like(occupied)
         
         # Scan for data regions more comprehensively
         for start_row in range(1, min(max_row, 500), 15):  # Sample every 15 rows
             for start_col in range(1, min(max_col, 50), 8):   # Sample every 8 columns
                 
-                region_key = f"{start_row}_{start_col}"
-                if region_key in processed_areas:
+                if processed[start_row, start_col]:
                     continue
                 
-                region = await self._analyze_comprehensive_data_region(cells_data, start_row, start_col, max_row, max_col)
+                # A region is built from at most this 30x25 window; skip windows that cannot reach 9 cells
+                if np.count_nonzero(occupied[start_row:start_row + 30, start_col:start_col + 25]) < 9:
+                    continue
+                
+                region = await self._analyze_comprehensive_data_region(cells_data, occupied, start_row, start_col, max_row, max_col)
                 
                 if region and region["cell_count"] >= 9:  # Minimum meaningful region size
                     regions.append(region)
                     
                     # Mark area as processed
-                    for row in range(region["start_row"], min(region["end_row"] + 1, max_row + 1)):
-                        for col in range(region["start_col"], min(region["end_col"] + 1, max_col + 1)):
-                            processed_areas.add(f"{row}_{col}")
+                    processed[region["start_row"]:region["end_row"] + 1, region["start_col"]:region["end_col"] + 1] = True
         
         return regions
     
-    async def _analyze_comprehensive_data_region(self, cells_data: Dict, start_row: int, start_col: int, max_row: int, max_col: int) -> Optional[Dict]:
+    async def _analyze_comprehensive_data_region(self, cells_data: Dict, occupied: np.ndarray, start_row: int, start_col: int, max_row: int, max_col: int) -> Optional[Dict]:
         """Analyze a potential comprehensive data region"""
         
         region_cells = []
         numeric_cells_in_region = []
         text_cells_in_region = []
         
-        # Expand region to find contiguous data
-        end_row = start_row
-        end_col = start_col
-        
-        for row in range(start_row, min(start_row + 30, max_row + 1)):  # Larger regions
-            row_has_data = False
-            for col in range(start_col, min(start_col + 25, max_col + 1)):  # Wider regions
-                cell_ref = f"{openpyxl.utils.get_column_letter(col)}{row}"
-                if cell_ref in cells_data:
-                    cell_data = cells_data[cell_ref]
-                    region_cells.append({
-                        "cell_ref": cell_ref,
-                        "value": cell_data["value"],
-                        "row": row,
-                        "col": col,
-                        "data_type": cell_data["data_type"]
-                    })
-                    
-                    if isinstance(cell_data["value"], (int, float)):
-                        numeric_cells_in_region.append(cell_data)
-                    elif isinstance(cell_data["value"], str):
-                        text_cells_in_region.append(cell_data)
-                    
-                    row_has_data = True
-                    end_row = max(end_row, row)
-                    end_col = max(end_col, col)
+        # Expand region to find contiguous data: larger (30 rows) and wider (25 cols) regions
+        window = occupied[start_row:min(start_row + 30, max_row + 1), start_col:min(start_col + 25, max_col + 1)]
+        row_counts = np.count_nonzero(window, axis=1)
+        
+        # The region ends at the first empty row once more than 6 cells have been collected
+        ends = np.flatnonzero((row_counts == 0) & (np.cumsum(row_counts) > 6))
+        if ends.size:
+            window = window[:ends[0]]
+        
+        # nonzero walks row-major, so cells come out in the same order as a row-by-row scan
+        row_offsets, col_offsets = np.nonzero(window)
+        end_row = start_row + int(row_offsets.max()) if row_offsets.size else start_row
+        end_col = start_col + int(col_offsets.max()) if col_offsets.size else start_col
+        
+        for row, col in zip((row_offsets + start_row).tolist(), (col_offsets + start_col).tolist()):
+            cell_ref = f"{openpyxl.utils.get_column_letter(col)}{row}"
+            cell_data = cells_data[cell_ref]
+            region_cells.append({
+                "cell_ref": cell_ref,
+                "value": cell_data["value"],
+                "row": row,
+                "col": col,
+                "data_type": cell_data["data_type"]
+            })
             
-            # If row has no data and we have some data, consider ending the region
-            if not row_has_data and len(region_cells) > 6:
-                break
+            if isinstance(cell_data["value"], (int, float)):
+                numeric_cells_in_region.append(cell_data)
+            elif isinstance(cell_data["value"], str):
+                text_cells_in_region.append(cell_data)
         
         if len(region_cells) >= 9:  # Minimum meaningful region
             region_analysis = {
@@ -575,8 +585,7 @@ class ComprehensiveExcelService:
             
             # Look for cells that might be totals/summaries
             if isinstance(value, str):
-                value_lower = value.lower()
-                if any(keyword in value_lower for keyword in ["total", "sum", "revenue", "profit", "loss", "net", "gross", "ebitda"]):
+                if _SUMMARY_KEYWORD_RE.search(value):
                     summary_indicators.append({
                         "cell_ref": cell_ref,
                         "text": value,
@@ -1,4 +1,5 @@
 import PyPDF2
+import re
 import fitz  # PyMuPDF
 from typing import List, Dict, Any, Tuple
 import structlog
@@ -8,6 +9,8 @@ from PIL import Image
 
 logger = structlog.get_logger()
 
+_DIGIT_RE = re.compile(r'\d')
+
 class PDFService:
     def __init__(self):
         pass
@@ -161,8 +164,7 @@ class PDFService:
     
     def _contains_number(self, text: str) -> bool:
         """Check if text contains numerical data"""
-        import re
-        return bool(re.search(r'\d', text))
+        return _DIGIT_RE.search(text) is not None
     
     def _process_table_blocks(self, table_blocks: List[Dict]) -> Dict[str, Any]:
         """Process a group of table blocks into structured table data"""
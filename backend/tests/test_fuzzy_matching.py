@@ -0,0 +1,53 @@
+import pytest
+
+from app.services.audit.fuzzy_matching import FuzzyMatchService
+
+
+@pytest.fixture
+def service():
+    service = FuzzyMatchService()
+    values = ["125", "-340", "1234", "42", "9876", "9,876", "12.5"]
+    assert service.load_excel_data([
+        {"value": value, "cell_address": f"B{row}", "sheet_name": "P&L", "table_title": "Summary"}
+        for row, value in enumerate(values, start=2)
+    ])
+    return service
+
+
+@pytest.mark.parametrize("pdf_value, cell", [
+    ("125", "B2"),
+    ("125.00", "B2"),
+    ("-340", "B3"),
+    ("1,234", "B4"),
+    (" 1234 ", "B4"),
+])
+def test_unique_exact_match(service, pdf_value, cell):
+    assert service.find_unique_exact_match(pdf_value)["cell_address"] == cell
+
+
+@pytest.mark.parametrize("pdf_value", [
+    "125%",     # percent changes the meaning
+    "$125",     # so does a currency sign
+    "(125)",    # accounting negative
+    "-125",     # sign flipped
+    "340",      # Excel holds -340
+    "42",       # too few digits to rule out coincidence
+    "9876",     # held by two cells
+    "12.5%",
+    "revenue",
+    "",
+])
+def test_no_local_match(service, pdf_value):
+    assert service.find_unique_exact_match(pdf_value) is None
+
+
+@pytest.mark.parametrize("pdf_value, excel_value, trusted", [
+    ("1,234", "1234", True),
+    ("-340", "-340", True),
+    ("-12.5", "12.5", False),
+    ("(3.2)", "3.2", False),
+    ("125%", "125", False),
+    ("42", "42", False),
+])
+def test_is_trusted_exact_match(service, pdf_value, excel_value, trusted):
+    assert service.is_trusted_exact_match(pdf_value, excel_value) is trusted
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from app.services.audit import gemini_cache
+from app.services.audit.gemini_cache import GeminiCache
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+def _counting_generate(text="answer", delay=0.0):
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        if delay:
+            await asyncio.sleep(delay)
+        return _Response(text)
+
+    return generate, calls
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return GeminiCache(path=str(tmp_path / "responses.sqlite3"), ttl_seconds=3600)
+
+
+def test_make_key_separates_parts():
+    assert GeminiCache.make_key("ab", "c") != GeminiCache.make_key("a", "bc")
+    assert GeminiCache.make_key("model", b"\x00\x01") == GeminiCache.make_key("model", b"\x00\x01")
+
+
+def test_miss_then_hit(cache):
+    generate, calls = _counting_generate()
+
+    async def run():
+        first = await cache.get_or_generate("k", generate)
+        second = await cache.get_or_generate("k", generate)
+        return first, second
+
+    assert asyncio.run(run()) == ("answer", "answer")
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_expired_entry_is_a_miss(cache, monkeypatch):
+    cache.put("k", "old")
+    now = gemini_cache.time.time()
+    monkeypatch.setattr(gemini_cache.time, "time", lambda: now + 7200)
+    assert cache.get("k") is None
+
+
+def test_concurrent_identical_requests_share_one_call(cache):
+    generate, calls = _counting_generate(delay=0.05)
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_generate("k", generate) for _ in range(3)])
+
+    assert asyncio.run(run()) == ["answer"] * 3
+    assert len(calls) == 1
+    assert cache.stats()["dedup_hits"] == 2
+    assert not cache._pending
+
+
+def test_invalidate_forces_a_new_call(cache):
+    generate, calls = _counting_generate()
+
+    async def run():
+        await cache.get_or_generate("k", generate)
+        cache.invalidate("k")
+        await cache.get_or_generate("k", generate)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_invalidate_doc_drops_only_that_document(cache):
+    cache.put("a", "1", doc_id="doc-1")
+    cache.put("b", "2", doc_id="doc-2")
+    assert cache.invalidate_doc("doc-1") == 1
+    assert cache.get("a") is None
+    assert cache.get("b") == "2"
+
+
+def test_failure_reaches_every_waiter_and_is_not_cached(cache):
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise RuntimeError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            *[cache.get_or_generate("k", generate) for _ in range(2)], return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(calls) == 1
+    assert cache.get("k") is None
+    assert not cache._pending
+
+
+def test_cancelled_waiter_does_not_cancel_the_shared_call(cache):
+    generate, calls = _counting_generate(delay=0.05)
+
+    async def run():
+        owner = asyncio.ensure_future(cache.get_or_generate("k", generate))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(cache.get_or_generate("k", generate))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await owner
+
+    assert asyncio.run(run()) == "answer"
+    assert len(calls) == 1
+
+
+def test_cancelled_owner_does_not_cancel_waiters(cache):
+    generate, calls = _counting_generate(delay=0.05)
+
+    async def run():
+        owner = asyncio.ensure_future(cache.get_or_generate("k", generate))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(cache.get_or_generate("k", generate))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        return await waiter
+
+    assert asyncio.run(run()) == "answer"
+    assert len(calls) == 1
+    # The shared call still stored its response
+    assert cache.get("k") == "answer"
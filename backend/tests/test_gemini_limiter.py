@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from google.api_core.exceptions import ResourceExhausted
+
+from app.services.audit import gemini_limiter
+from app.services.audit.gemini_limiter import AIMD_BETA, GeminiLimiter, estimate_tokens
+
+
+def test_estimate_tokens_counts_text_and_image_tiles():
+    assert estimate_tokens("x" * 400) == 100
+    # A small image is one tile; a 1000x800 image spans 2x2 tiles
+    assert estimate_tokens("", [(300, 300)]) == 258
+    assert estimate_tokens("", [(1000, 800)]) == 4 * 258
+
+
+def test_request_window_blocks_until_oldest_request_expires():
+    limiter = GeminiLimiter(rpm=2, tpm=1_000_000, max_concurrency=10)
+    limiter._requests.extend([100.0, 110.0])
+    assert limiter._wait_time(120.0, 0) == pytest.approx(40.0)
+    # Once the first request leaves the one-minute window a new one may start
+    limiter._trim(160.0)
+    assert limiter._wait_time(160.0, 0) == 0.0
+
+
+def test_token_window_blocks_until_budget_frees_up():
+    limiter = GeminiLimiter(rpm=100, tpm=1000, max_concurrency=10)
+    limiter._tokens.append((100.0, 800))
+    limiter._tokens_in_window = 800
+    assert limiter._wait_time(130.0, 100) == 0.0
+    assert limiter._wait_time(130.0, 300) == pytest.approx(30.0)
+
+
+def test_oversized_request_passes_on_an_empty_window():
+    limiter = GeminiLimiter(rpm=100, tpm=1000, max_concurrency=10)
+    assert limiter._wait_time(0.0, 5000) == 0.0
+
+
+def test_concurrency_limit_waits_for_a_release():
+    limiter = GeminiLimiter(rpm=100, tpm=1_000_000, max_concurrency=1)
+    limiter._in_flight = 1
+    assert limiter._wait_time(0.0, 0) is None
+
+
+def test_aimd_halves_on_throttle_and_grows_on_fast_success():
+    async def run():
+        limiter = GeminiLimiter(rpm=100, tpm=1_000_000, max_concurrency=8, target_latency=1.0)
+        for _ in range(2):
+            await limiter.acquire()
+        limiter.release(latency=0.1, throttled=True)
+        assert limiter._limit == pytest.approx(8 * AIMD_BETA)
+
+        limit = limiter._limit
+        limiter.release(latency=0.1)
+        assert limiter._limit == pytest.approx(limit + 1.0 / limit)
+
+        # Slow successes leave the window unchanged
+        await limiter.acquire()
+        limit = limiter._limit
+        limiter.release(latency=5.0)
+        assert limiter._limit == pytest.approx(limit)
+
+    asyncio.run(run())
+
+
+def test_call_backs_off_and_retries_on_resource_exhausted(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(gemini_limiter.asyncio, "sleep", fake_sleep)
+    monkeypatch.setattr(gemini_limiter.random, "uniform", lambda a, b: 1.0)
+
+    attempts = 0
+
+    async def generate():
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise ResourceExhausted("quota")
+        return "ok"
+
+    async def run():
+        limiter = GeminiLimiter(rpm=100, tpm=1_000_000, max_concurrency=4)
+        result = await limiter.call(generate)
+        assert limiter._in_flight == 0
+        return result
+
+    assert asyncio.run(run()) == "ok"
+    assert attempts == 3
+    base = gemini_limiter.GEMINI_RETRY_BASE_DELAY
+    assert delays == [base, base * 2]
+
+
+def test_call_gives_up_after_max_retries(monkeypatch):
+    async def fake_sleep(delay):
+        pass
+
+    monkeypatch.setattr(gemini_limiter.asyncio, "sleep", fake_sleep)
+
+    async def generate():
+        raise ResourceExhausted("quota")
+
+    async def run():
+        limiter = GeminiLimiter(rpm=100, tpm=1_000_000, max_concurrency=4)
+        with pytest.raises(ResourceExhausted):
+            await limiter.call(generate)
+        assert limiter._in_flight == 0
+        assert limiter.concurrency_limit == 1
+
+    asyncio.run(run())